@@ -2,6 +2,7 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import concurrent.futures
 import contextlib
 import functools
 import os
@@ -10,10 +11,14 @@ import pathlib
 from cui.core import \
     context, core_api_ns, Core, \
     init_func, update_func, post_init_func, \
-    runloop_cancel, runloop_result, \
-    run_interactive, interactive
+    runloop_cancel, runloop_result, Prompt, \
+    run_interactive, interactive, \
+    LOG_DEBUG, LOG_INFO, LOG_WARNING, LOG_ERROR
 from cui.colors import ColorException
-from cui.util import add_to_sys_path
+from cui.util import add_to_sys_path, highlight_spans
+from cui.util.completion_index import CompletionIndex
+from cui.util.completion_request import CompletionRequest
+from cui.util.dir_cache import DirectoryCache
 
 
 with core_api_ns(globals()) as core_api:
@@ -25,6 +30,9 @@ with core_api_ns(globals()) as core_api:
     core_api('remove_exit_handler')
     core_api('running')
     core_api('bye',                    'C-x C-c')
+    core_api('start_kbd_macro',        'C-x (')
+    core_api('end_kbd_macro',          'C-x )')
+    core_api('call_last_kbd_macro',    'C-x e')
     core_api('runloop_enter')
     core_api('runloop_level')
     core_api('activate_minibuffer')
@@ -73,6 +81,14 @@ def base_directory(*args):
 def user_directory(*args):
     return os.path.join(os.path.expanduser(os.path.join(pathlib.Path.home(), '.cui')), *args)
 
+def enable_log_file(file_name='cui.log', max_size=1024 * 1024, backup_count=3):
+    """
+    Write the log to ``file_name`` in the user directory, rotating
+    the file once it exceeds ``max_size`` bytes.
+    """
+    from cui.tools import log_file
+    return log_file.enable(file_name, max_size, backup_count)
+
 # Shortcuts
 
 def _set_key(keymap, keychord, fn):
@@ -130,21 +146,200 @@ def has_run(fn):
 
 # =============== Minibuffer Input primitives ===================
 
-def complete_from_list(list_function):
+def complete_from_list(list_function, fuzzy=False, fuzzy_limit=100):
+    """
+    Create a completion function completing from the strings returned
+    by ``list_function``.
+
+    ``list_function`` is called once per prompt, when completion is first
+    requested. Its result is indexed, so subsequent completions only
+    need to look up the matches of the minibuffer content.
+
+    :param fuzzy: If no string starts with the content of the minibuffer,
+                  display the ``fuzzy_limit`` best strings containing its
+                  characters in order, best match first.
+    """
     def _complete_from_list(display_completions):
+        index = None
         def __complete_from_list(completion_id, buffer_content):
-            matches = list(filter(lambda m: m.startswith(buffer_content), list_function()))
-            prefix = os.path.commonprefix(matches)
-            if len(matches) == 0:
-                message('No completions.')
-                return buffer_content
-            elif len(matches) > 1:
-                display_completions(completion_id, matches)
-            return prefix
+            nonlocal index
+            if index is None:
+                index = CompletionIndex(list_function())
+            prefix, matches = index.complete(buffer_content)
+            if len(matches) == 0 and fuzzy:
+                return _complete_fuzzy(index, completion_id, buffer_content,
+                                       display_completions, fuzzy_limit)
+            return _apply_matches(completion_id, buffer_content, prefix, matches,
+                                  display_completions)
         return __complete_from_list
     return _complete_from_list
 
 
+def _completing_live():
+    state = Core().mini_buffer_state
+    return bool(state and state.get('live'))
+
+
+def _apply_matches(completion_id, buffer_content, result, matches, display_completions,
+                   displayed=None, live=None):
+    """
+    Returns the content of the minibuffer after completion, displaying
+    ``displayed`` (by default ``matches``) if there are several matches.
+    During live completion matches are always displayed.
+    """
+    displayed = matches if displayed is None else displayed
+    if _completing_live() if live is None else live:
+        display_completions(completion_id, displayed)
+    elif len(matches) == 0:
+        message('No completions.')
+        return buffer_content
+    elif len(matches) > 1:
+        display_completions(completion_id, displayed)
+    return result
+
+
+def _complete_fuzzy(index, completion_id, buffer_content, display_completions, limit):
+    matches = index.fuzzy_complete(buffer_content, limit)
+    return _apply_matches(completion_id, buffer_content,
+                          matches[0][0] if len(matches) == 1 else buffer_content,
+                          matches, display_completions,
+                          [highlight_spans(candidate,
+                                           [(position, position + 1) for position in positions],
+                                           {'attributes': ['bold']})
+                           for candidate, positions in matches])
+
+
+def complete_async(provider, timeout=0.5):
+    """
+    Create a completion function completing from the candidates
+    provided asynchronously by ``provider``.
+
+    ``provider`` is called with a ``CompletionRequest`` for the content
+    of the minibuffer. It may stream candidates by calling ``add`` and
+    ``finish`` on the request from any thread, or return a future that
+    results in an iterable of candidates. If the content of the minibuffer
+    changes while the request is pending, the request is cancelled.
+
+    If the request is not finished after ``timeout`` seconds, the
+    candidates received so far are displayed and updated as more
+    candidates arrive.
+    """
+    def _complete_async(display_completions):
+        def __complete_async(completion_id, buffer_content):
+            completion = concurrent.futures.Future()
+            live = _completing_live()
+            partial = False
+            timer = None
+
+            def _matches():
+                candidates = request.candidates()
+                prefix = candidates[0] if len(candidates) == 1 else \
+                         os.path.commonprefix(candidates)
+                return (prefix if prefix.startswith(buffer_content) else buffer_content,
+                        candidates)
+
+            def _update():
+                if completion.done():
+                    return
+                if request.done:
+                    if timer:
+                        timer.cancel()
+                    if request.exception is not None:
+                        completion.set_exception(request.exception)
+                    else:
+                        completion.set_result(_apply_matches(completion_id, buffer_content,
+                                                             *_matches(), display_completions,
+                                                             live=live))
+                elif partial:
+                    display_completions(completion_id, request.candidates())
+
+            def _show_partial():
+                nonlocal partial
+                if not completion.done():
+                    partial = True
+                    display_completions(completion_id, request.candidates())
+
+            def _cancelled(_):
+                if completion.cancelled():
+                    request.cancel()
+                    if timer:
+                        timer.cancel()
+
+            request = CompletionRequest(buffer_content,
+                                        functools.partial(call_in_event_loop, _update))
+            completion.add_done_callback(_cancelled)
+            result = provider(request)
+            if hasattr(result, 'add_done_callback'):
+                request.finish_with(result)
+
+            if request.done:
+                # Finished synchronously, drop the updates posted
+                completion.cancel()
+                if request.exception is not None:
+                    raise request.exception
+                return _apply_matches(completion_id, buffer_content, *_matches(),
+                                      display_completions)
+            timer = add_timer(timeout, _show_partial)
+            return completion
+        return __complete_async
+    return _complete_async
+
+
+def prompt_string(prompt, default='', complete_fn=None, update_fn=None, keymap=None):
+    """
+    Returns a Prompt reading a string from minibuffer.
+
+    Unlike ``read_string``, this does not wait for input. Instead
+    interactive commands implemented as generators yield the prompt
+    and are resumed with the string read, e.g.:
+
+    .. code-block:: python
+
+       @interactive(lambda: cui.prompt_string('Name'))
+       def greet(name):
+           age = yield from cui.prompt_integer('Age')
+           cui.message('Hello %s (%s)' % (name, age))
+
+    The parameters correspond to ``read_string``. Additionally, a dict
+    mapping keychords to functions may be provided as ``keymap``, which
+    are bound while the prompt is displayed.
+    """
+    return Prompt('%s: ' % prompt,
+                  default,
+                  complete_fn(display_completions) if complete_fn else None,
+                  close_completions,
+                  update_fn,
+                  keymap)
+
+
+def prompt_integer(prompt, default=''):
+    """
+    Read an integer from minibuffer, to be used with ``yield from``
+    in an interactive command. See ``prompt_string``.
+    """
+    while True:
+        try:
+            return int((yield prompt_string(prompt, default=default)))
+        except ValueError:
+            message('Enter an integer.')
+
+
+def prompt_bool(prompt, default=False):
+    """
+    Read yes or no from minibuffer, to be used with ``yield from``
+    in an interactive command. See ``prompt_string``.
+    """
+    while True:
+        result = yield prompt_string('%s (yes/no)' % prompt,
+                                     default=('yes' if default else 'no'))
+        if result == 'yes':
+            return True
+        elif result == 'no':
+            return False
+        else:
+            message('Enter yes or no.')
+
+
 def read_integer(prompt, default=''):
     while True:
         try:
@@ -165,36 +360,67 @@ def read_bool(prompt, default=False):
             message('Enter yes or no.')
 
 
-def read_string(prompt, default='', complete_fn=None):
+def read_string(prompt, default='', complete_fn=None, update_fn=None):
+    """
+    Read a string from minibuffer.
+
+    :param prompt: Prompt to be displayed
+    :param default: The initial content of the minibuffer
+    :param complete_fn: A completion function, e.g., ``complete_files``
+    :param update_fn: If provided, this function is called with the
+                      content of the minibuffer each time it changes
+    """
     return runloop_enter(lambda: activate_minibuffer(
         '%s: ' % prompt,
         lambda b: runloop_result(b),
         default,
         complete_fn(display_completions) if complete_fn else None,
-        close_completions
+        close_completions,
+        update_fn
     ))
 
 
+_directory_cache = DirectoryCache()
+
+# The number of subdirectories prefetched while a file name is typed
+PREFETCH_DIRECTORIES = 8
+
+
+def prefetch_directories(buffer_content):
+    """
+    Scan the subdirectories of the directory of ``buffer_content``, which
+    start with its base name, in the background.
+
+    This may be passed as ``update_fn`` to ``read_string``, so that
+    completing a file name after descending into a directory is served
+    from the directory cache.
+    """
+    basename = os.path.basename(buffer_content)
+    dirname = os.path.dirname(buffer_content) or os.curdir
+    listing = _directory_cache.listing(dirname)
+    if listing is None:
+        return
+    subdirs = [os.path.join(dirname, name)
+               for name in listing.names.matches(basename)
+               if name in listing.directories]
+    _directory_cache.prefetch(subdirs[:PREFETCH_DIRECTORIES])
+
+
 def complete_files(display_completions):
     def _complete_files(completion_id, buffer_content):
         basename = os.path.basename(buffer_content)
         dirname = os.path.dirname(buffer_content)
-        matches = list(filter(lambda d: d.startswith(basename), os.listdir(dirname)))
-        prefix = os.path.commonprefix(matches)
+        listing = _directory_cache.listing(dirname or os.curdir)
+        prefix, matches = listing.names.complete(basename) if listing else (basename, [])
         result = os.path.join(dirname, prefix)
-        if len(matches) == 0:
-            message('No completions.')
-            return buffer_content
-        elif len(matches) == 1:
-            if os.path.isdir(result):
-                return os.path.join(result, '')
-        else:
-            display_completions(completion_id,
-                                list(map(lambda match: [os.path.join(dirname, ''),
-                                                        {'content': match,
-                                                         'attributes': ['bold']}],
-                                         matches)))
-        return result
+        if len(matches) == 1 and prefix in listing.directories:
+            result = os.path.join(result, '')
+        return _apply_matches(completion_id, buffer_content, result, matches,
+                              display_completions,
+                              list(map(lambda match: [os.path.join(dirname, ''),
+                                                      {'content': match,
+                                                       'attributes': ['bold']}],
+                                       matches)))
     return _complete_files
 
 
@@ -213,16 +439,31 @@ def read_file(prompt, default=None):
     f = os.path.join(default or current_buffer(no_minibuffer=True).cwd, '')
 
     while True:
-        f = read_string(prompt, f, complete_files)
-        if os.path.exists(f):
+        f = read_string(prompt, f, complete_files, prefetch_directories)
+        if _directory_cache.exists(f):
+            return f
+        message('File \'%s\' does not exist.' % f)
+
+
+def prompt_file(prompt, default=None):
+    """
+    Read a file from minibuffer, to be used with ``yield from``
+    in an interactive command. See ``prompt_string`` and ``read_file``.
+    """
+    f = os.path.join(default or current_buffer(no_minibuffer=True).cwd, '')
+
+    while True:
+        f = yield prompt_string(prompt, f, complete_files, prefetch_directories)
+        if _directory_cache.exists(f):
             return f
         message('File \'%s\' does not exist.' % f)
 
 # ==================== Execute functions =======================
 
 @global_key('M-x')
-@interactive(lambda: read_string('Command',
-                                 complete_fn=complete_from_list(lambda: globals().keys())))
+@interactive(lambda: prompt_string('Command',
+                                   complete_fn=complete_from_list(lambda: globals().keys(),
+                                                                  fuzzy=True)))
 def exec_command(command):
     """
     Execute a command interactively.
@@ -234,14 +475,24 @@ def exec_command(command):
 
     :param command: The command to be executed.
     """
-    result = run_interactive(globals()[command])
+    return run_interactive(globals()[command], result_fn=_display_result)
+
+
+def _display_result(result):
     if result:
         message(str(result))
-    return result
+
+
+@interactive(lambda: prompt_integer('Repetitions'))
+def repeat_kbd_macro(count):
+    """
+    Replay the last keyboard macro ``count`` times.
+    """
+    call_last_kbd_macro(count)
 
 
 @global_key('M-e')
-@interactive(lambda: read_string('Eval'))
+@interactive(lambda: prompt_string('Eval'))
 def eval_python(code_string):
     """
     Evaluate Python expression ``code_string``
@@ -305,6 +556,32 @@ def post_async_event(name):
     """
     return Core().io_selector.post_async_event(name)
 
+def call_in_event_loop(handler, *args):
+    """
+    Invoke ``handler`` with ``args`` on the cui event-loop. Unlike
+    the other functions of this module, this may be called from any
+    thread, e.g., from the done callback of a future.
+
+    :param handler: The handler function to be invoked.
+    :param args: The arguments passed to ``handler``.
+    """
+    return Core().io_selector.call_in_event_loop(handler, *args)
+
+def add_timer(delay, handler):
+    """
+    Invoke ``handler`` without arguments on the cui event-loop after
+    ``delay`` seconds have passed. Pending input is processed before
+    timers, so scheduling the continuation of a long-running operation
+    with a ``delay`` of 0 keeps the ui responsive.
+
+    Returns a timer object, whose method ``cancel`` may be used to
+    cancel the invocation.
+
+    :param delay: The delay in seconds.
+    :param handler: The handler function to be invoked.
+    """
+    return Core().io_selector.add_timer(delay, handler)
+
 # Hooks
 
 def def_hook(path):
@@ -325,9 +602,9 @@ def run_hook(path, *args, **kwargs):
 
 # Colors
 
-@interactive(lambda: read_string('Color name',
-                                 complete_fn=complete_from_list(get_colors)),
-             lambda: read_string('Color (hex string)'))
+@interactive(lambda: prompt_string('Color name',
+                                   complete_fn=complete_from_list(get_colors)),
+             lambda: prompt_string('Color (hex string)'))
 def def_colors(name, string):
     """
     Define a new color or redefine an existing color.
@@ -344,16 +621,16 @@ def def_colors(name, string):
         message('%s' % e)
 
 
-@interactive(lambda: read_string('Background type',
-                                 complete_fn=complete_from_list(get_backgrounds)))
+@interactive(lambda: prompt_string('Background type',
+                                   complete_fn=complete_from_list(get_backgrounds)))
 def get_background(bg_type):
     return Core().get_background_color(bg_type)
 
 
-@interactive(lambda: read_string('Background type',
-                                 complete_fn=complete_from_list(get_backgrounds)),
-             lambda: read_string('Color name',
-                                 complete_fn=complete_from_list(get_colors)))
+@interactive(lambda: prompt_string('Background type',
+                                   complete_fn=complete_from_list(get_backgrounds)),
+             lambda: prompt_string('Color name',
+                                   complete_fn=complete_from_list(get_colors)))
 def def_background(bg_type, color_name):
     """
     Redefine an existing background definition.
@@ -373,16 +650,16 @@ def def_background(bg_type, color_name):
         message('%s' % e)
 
 
-@interactive(lambda: read_string('Foreground type',
-                                 complete_fn=complete_from_list(get_foregrounds)))
+@interactive(lambda: prompt_string('Foreground type',
+                                   complete_fn=complete_from_list(get_foregrounds)))
 def get_foreground(fg_type):
     return Core().get_foreground_color(fg_type)
 
 
-@interactive(lambda: read_string('Foreground type',
-                                 complete_fn=complete_from_list(get_foregrounds)),
-             lambda: read_string('Color name',
-                                 complete_fn=complete_from_list(get_colors)))
+@interactive(lambda: prompt_string('Foreground type',
+                                   complete_fn=complete_from_list(get_foregrounds)),
+             lambda: prompt_string('Color name',
+                                   complete_fn=complete_from_list(get_colors)))
 def def_foreground(fg_type, color_name):
     try:
         return Core().def_foreground(fg_type, color_name)
@@ -561,18 +838,36 @@ def close_completions(completion_id):
                 completion_id)
 
 
-@interactive(lambda: read_file('JSON File'))
+@interactive(lambda: prompt_file('JSON File'))
 def display_static(json_file):
     from cui import buffers_std
     switch_buffer(buffers_std.StaticBuffer, json_file)
 
 
+@interactive(lambda: prompt_file('View File'))
+def view_file(file_path):
+    """
+    Display the file ``file_path``, without loading it into memory.
+    """
+    from cui import buffers_std
+    switch_buffer(buffers_std.FileViewBuffer, file_path)
+
+
+@interactive(lambda: prompt_file('Tail File'))
+def tail_file(file_path):
+    """
+    Display the file ``file_path`` and follow lines appended to it.
+    """
+    from cui import buffers_std
+    switch_buffer(buffers_std.TailBuffer, file_path)
+
+
 from cui.buffers import ListBuffer, with_current_buffer
 
 @api_fn
 @local_key(ListBuffer, 'M-g g')
 @with_current_buffer
-@interactive(lambda: read_integer('Item'))
+@interactive(lambda: prompt_integer('Item'))
 def goto_item(b, item):
     return goto_item_in_buffer(b, item)
 
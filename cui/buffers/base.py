@@ -6,9 +6,11 @@ import cui
 import os
 
 from cui.keymap import WithKeymap
-from cui.util import deep_get, deep_put, minmax
+from cui.util import deep_get, deep_put, minmax, line_text
 
+from .search import Search
 from .util import with_current_buffer, with_window
+from .wrap import SoftWrap
 
 
 class Buffer(WithKeymap):
@@ -87,12 +89,27 @@ class Buffer(WithKeymap):
         """
         pass
 
+    def on_kill(self):
+        """
+        This function will be called after the buffer has been killed.
+        It allows the buffer to release resources, e.g. to unregister
+        waitables from the event-loop.
+        """
+        pass
+
     def line_count(self):
         pass
 
     def get_lines(self, window):
         pass
 
+    def get_display_lines(self, window):
+        """
+        Returns the lines displayed in ``window``, which by default are
+        the lines provided by ``get_lines``.
+        """
+        return self.get_lines(window)
+
 
 @with_current_buffer
 def scroll_up(b):
@@ -122,19 +139,78 @@ def scroll_page_down(b):
     """
     b.scroll_page_down()
 
+@with_current_buffer
+def scroll_left(b):
+    """
+    Scroll current buffer one column to the left.
+    """
+    b.scroll_left()
+
+@with_current_buffer
+def scroll_right(b):
+    """
+    Scroll current buffer one column to the right.
+    """
+    b.scroll_right()
+
+@with_current_buffer
+def isearch_forward(b):
+    """
+    Search forward for a regular expression while typing.
+    Submitting the previous expression again moves to the next match.
+    """
+    return b.isearch()
+
+@with_current_buffer
+def isearch_backward(b):
+    """
+    Search backward for a regular expression while typing.
+    Submitting the previous expression again moves to the previous match.
+    """
+    return b.isearch(backward=True)
+
+@with_current_buffer
+def toggle_soft_wrap(b):
+    """
+    Toggle wrapping lines that are longer than the window is wide.
+    """
+    b.toggle_soft_wrap()
+
 class ScrollableBuffer(Buffer):
     __keymap__ = {
         'S-<up>':     scroll_up,
         'S-<pgup>':   scroll_page_up,
         'S-<down>':   scroll_down,
         'S-<pgdown>': scroll_page_down,
+        'S-<left>':   scroll_left,
+        'S-<right>':  scroll_right,
+        'C-s':        isearch_forward,
+        'C-r':        isearch_backward,
+        'C-x w':      toggle_soft_wrap,
     }
 
+    # Buffers providing random access to their lines implement
+    # get_line(window, index), which enables soft wrapping.
+    get_line = None
+
     def __init__(self, *args):
         super(ScrollableBuffer, self).__init__(*args)
         self.def_variable(['win/buf', 'first-row'], 0)
+        self.def_variable(['win/buf', 'first-column'], 0)
+        self.def_variable(['win/buf', 'dropped-rows'], 0)
+        self._search = None
+        self._soft_wrap = None
+        self._dropped_lines = 0
+        self._dropped_rows = 0
 
     def scroll_up(self, step=1):
+        window = self.window()
+        if self._soft_wrap and window:
+            self.set_variable(['win/buf', 'first-row'],
+                              self._soft_wrap.move(window,
+                                                   self.get_variable(['win/buf', 'first-row']),
+                                                   -step))
+            return
         self.set_variable(['win/buf', 'first-row'],
                           max(0,
                               self.get_variable(['win/buf', 'first-row']) - step))
@@ -144,6 +220,14 @@ class ScrollableBuffer(Buffer):
         self.scroll_up(window.rows)
 
     def scroll_down(self, step=1):
+        window = self.window()
+        if self._soft_wrap and window:
+            first_row = self._soft_wrap.move(window,
+                                             self.get_variable(['win/buf', 'first-row']),
+                                             step)
+            self.set_variable(['win/buf', 'first-row'],
+                              min(max(0, self.row_count(window) - 4), first_row))
+            return
         self.set_variable(['win/buf', 'first-row'],
                           min(max(0, self.line_count() - 4),
                               self.get_variable(['win/buf', 'first-row']) + step))
@@ -152,6 +236,159 @@ class ScrollableBuffer(Buffer):
     def scroll_page_down(self, window):
         self.scroll_down(window.rows)
 
+    def scroll_left(self, step=1):
+        self.set_variable(['win/buf', 'first-column'],
+                          max(0, self.get_variable(['win/buf', 'first-column']) - step))
+
+    @with_window
+    def scroll_right(self, window, step=1):
+        if self._soft_wrap:
+            return
+        # Scroll no further than the end of the longest line displayed
+        max_column = max(map(len, map(line_text, self.get_lines(window))), default=0)
+        self.set_variable(['win/buf', 'first-column'],
+                          minmax(0,
+                                 self.get_variable(['win/buf', 'first-column']) + step,
+                                 max_column - 1))
+
+    def scroll_to_bottom(self, window):
+        """
+        Scroll so that the last line is displayed at the bottom of ``window``.
+        """
+        if self._soft_wrap:
+            last_row = self._soft_wrap.move(window, self._soft_wrap.row_count(window), 0)
+            first_row = self._soft_wrap.move(window, last_row, 1 - window.rows)
+        else:
+            first_row = max(self.line_count() - window.rows, 0)
+        self.set_variable(['win/buf', 'first-row'], first_row)
+
+    def dropped_lines(self):
+        """
+        Returns the number of lines discarded from the start of the buffer
+        so far, e.g., by a RingBuffer. Override this together with calling
+        ``keep_position`` in ``on_pre_render_win``, if lines are discarded.
+        """
+        return 0
+
+    def keep_position(self, window):
+        """
+        Keep ``window`` displaying the same lines, after lines have been
+        discarded from the start of the buffer.
+        """
+        dropped = self.dropped_lines()
+        count = dropped - self._dropped_lines
+        if count > 0:
+            self._dropped_lines = dropped
+            self._dropped_rows += self._soft_wrap.drop_lines(count) if self._soft_wrap else count
+
+        delta = self._dropped_rows - window._state['dropped-rows']
+        if delta > 0:
+            first_row = max(0, window._state['first-row'] - delta)
+            if window is self.window():
+                self.set_variable(['win/buf', 'dropped-rows'], self._dropped_rows)
+                self.set_variable(['win/buf', 'first-row'], first_row)
+            else:
+                window.update_state(['dropped-rows'], self._dropped_rows)
+                window.update_state(['first-row'], first_row)
+
+    @with_window
+    def toggle_soft_wrap(self, window):
+        if self.get_line is None:
+            cui.message('Soft wrap is not supported by this buffer.')
+            return
+
+        # Discarded lines are counted in rows of the current mode
+        self.keep_position(window)
+        first_row = self.get_variable(['win/buf', 'first-row'])
+        if self._soft_wrap:
+            first_row = self._soft_wrap.line_index(window, first_row)
+            self._soft_wrap = None
+        else:
+            self._soft_wrap = SoftWrap(self)
+            first_row = self._soft_wrap.line_row(window, first_row)
+            self.set_variable(['win/buf', 'first-column'], 0)
+        self.set_variable(['win/buf', 'first-row'], first_row)
+
+    def row_count(self, window):
+        """
+        Returns the number of rows displayed in ``window``, which differs
+        from ``line_count`` if soft wrap is enabled.
+        """
+        return self._soft_wrap.row_count(window) if self._soft_wrap else self.line_count()
+
+    def line_row(self, window, index):
+        """
+        Returns the row at which line ``index`` is displayed in ``window``.
+        """
+        return self._soft_wrap.line_row(window, index) if self._soft_wrap else index
+
+    def isearch(self, backward=False):
+        """
+        Returns a generator running an incremental search, see
+        ``cui.prompt_string``.
+        """
+        if self._search is None:
+            self._search = Search(self)
+        search = self._search
+        previous_query = search.query
+        origin = self.search_position()
+        repeated = False
+
+        def repeat(backward):
+            nonlocal repeated
+            repeated = True
+            search.next_match(backward)
+
+        search.start(backward)
+        try:
+            query = yield cui.prompt_string('I-search%s' % (' backward' if backward else ''),
+                                            default=previous_query,
+                                            update_fn=search.set_query,
+                                            keymap={
+                                                'C-s': lambda: repeat(False),
+                                                'C-r': lambda: repeat(True),
+                                            })
+        except cui.core.RunloopCancel:
+            self.search_goto(origin)
+            raise
+        finally:
+            search.stop()
+        search.set_query(query)
+        # Submitting the previous query again moves to the next match,
+        # unless matches have been visited in the prompt
+        if query and query == previous_query and not repeated:
+            search.next_match(backward)
+
+    def search_count(self):
+        """
+        Returns the number of units searched by isearch.
+        Override this together with ``search_text`` to support searching.
+        """
+        return 0
+
+    def search_text(self, index):
+        """
+        Returns the text of unit ``index``.
+        """
+        return None
+
+    def search_position(self):
+        return self.get_variable(['win/buf', 'first-row'])
+
+    def search_goto(self, index):
+        index = minmax(0, index, max(0, self.line_count() - 1))
+        window = self.window()
+        self.set_variable(['win/buf', 'first-row'],
+                          self.line_row(window, index) if window else index)
+
+    def get_display_lines(self, window):
+        highlight = self._search.highlight \
+                    if self._search is not None and self._search.active else None
+        if self._soft_wrap:
+            return self._soft_wrap.get_rows(window, window._state['first-row'], highlight)
+        lines = self.get_lines(window)
+        return map(highlight, lines) if highlight else lines
+
 
 @with_current_buffer
 def previous_item(b):
@@ -234,14 +471,19 @@ class ListBuffer(ScrollableBuffer):
     def recenter(self, window, out_of_bounds=False):
         max_lines = window.dimensions[0]
         first_row = self.get_variable(['win/buf', 'first-row'])
-        selected_row = self.get_variable(['win/buf', 'selected-item']) * self._item_height
+        selected_row = self.line_row(window,
+                                     self.get_variable(['win/buf', 'selected-item']) *
+                                     self._item_height)
         selected_row_offset = selected_row - first_row
         if not out_of_bounds or \
            selected_row_offset < 0 or \
            selected_row_offset > max_lines - 1:
-            center = first_row - (max_lines // 2 - (selected_row - first_row))
+            if self._soft_wrap:
+                center = self._soft_wrap.move(window, selected_row, -(max_lines // 2))
+            else:
+                center = first_row - (max_lines // 2 - (selected_row - first_row))
             self.set_variable(['win/buf', 'first-row'],
-                              minmax(0, center, self.line_count() - 4))
+                              minmax(0, center, self.row_count(window) - 4))
 
     def item_up(self, step=1):
         self.set_variable(['win/buf', 'selected-item'],
@@ -279,10 +521,25 @@ class ListBuffer(ScrollableBuffer):
     def hide_selection(self):
         return False
 
+    def _item_line(self, window, item, item_index, line_index, hide_selection):
+        return (
+            {
+                'content': item[line_index],
+                'foreground': 'selection',
+                'background': 'selection'
+            } if window._state['selected-item'] == item_index and not hide_selection else (
+                item[line_index]
+            )
+        ) if line_index < len(item) else ''
+
+    def get_line(self, window, index):
+        item_index, line_index = divmod(index, self._item_height)
+        item = self.render_item(window, self.items()[item_index], item_index)
+        return self._item_line(window, item, item_index, line_index, self.hide_selection())
+
     def get_lines(self, window):
         hide_selection = self.hide_selection()
         first_row = window._state['first-row']
-        selected_item = window._state['selected-item']
         item = None
         for row_index in range(first_row, min(self.line_count(),
                                               window.dimensions[0] + first_row)):
@@ -290,19 +547,26 @@ class ListBuffer(ScrollableBuffer):
             line_index = row_index % self._item_height
             if item is None or line_index == 0:
                 item = self.render_item(window, self.items()[item_index], item_index)
-            yield (
-                {
-                    'content': item[line_index],
-                    'foreground': 'selection',
-                    'background': 'selection'
-                } if selected_item == item_index and not hide_selection else (
-                    item[line_index]
-                )
-            ) if line_index < len(item) else ''
+            yield self._item_line(window, item, item_index, line_index, hide_selection)
 
     def on_item_selected(self):
         pass
 
+    def search_count(self):
+        return self.item_count()
+
+    def search_text(self, index):
+        window = self.window() or cui.selected_window()
+        return '\n'.join(map(line_text, self.render_item(window, self.items()[index], index)))
+
+    def search_position(self):
+        return self.get_variable(['win/buf', 'selected-item'])
+
+    def search_goto(self, index):
+        self.set_variable(['win/buf', 'selected-item'],
+                          minmax(0, index, max(0, self.item_count() - 1)))
+        self.recenter(out_of_bounds=True)
+
     def items(self):
         return []
 
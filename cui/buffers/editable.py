@@ -3,8 +3,13 @@
 # found in the LICENSE file.
 
 import cui
+import re
 
 from cui.keymap import WithKeymap
+from cui.util import line_text
+from cui.util.gap_buffer import GapBuffer
+from cui.util.history import History, HistorySearch
+from cui.util.ring_buffer import RingBuffer
 
 from .base import ScrollableBuffer
 from .util import with_current_buffer, close_buffer
@@ -24,7 +29,7 @@ def first_char(buf):
 
 @with_current_buffer
 def last_char(buf):
-    return buf.set_cursor(len(buf.buffer()))
+    return buf.set_cursor(len(buf._buffer))
 
 @with_current_buffer
 def delete_next_char(buf):
@@ -45,12 +50,20 @@ def next_history_item(buf):
     if buf.history_index != -1:
         buf.activate_history_item(buf.history_index + 1)
 
+@with_current_buffer
+def history_search(buf):
+    """
+    Search the input history backward while typing.
+    Submitting the previous query again finds the next older match.
+    """
+    return buf.history_search()
+
 @with_current_buffer
 def delete_to_eol(buf):
     """
     Delete text from the cursor to the end of the line
     """
-    buf.delete_chars(len(buf.buffer()) - buf.cursor)
+    buf.delete_chars(len(buf._buffer) - buf.cursor)
 
 @with_current_buffer
 def complete_input(buf):
@@ -60,9 +73,27 @@ def complete_input(buf):
     """
     buf.auto_complete()
 
+_histories = {}
+
+
+def get_history(key):
+    """
+    Returns the input history named ``key``, which is persisted in the
+    history directory of the user directory.
+    """
+    if key not in _histories:
+        file_name = re.sub(r'[^\w.-]+', '_', key)
+        _histories[key] = History(cui.get_variable(['history-limit']),
+                                  cui.user_directory('history', file_name))
+    return _histories[key]
+
+
 class InputBuffer(WithKeymap):
     """
     Buffer Mixin for line-based editing
+
+    The edited text is stored in ``_buffer`` as a GapBuffer, so editing
+    at the cursor does not copy the text.
     """
     __keymap__ = {
         '<enter>': with_current_buffer(lambda buf: buf.send_current_buffer()),
@@ -75,33 +106,55 @@ class InputBuffer(WithKeymap):
         '<right>': next_char,
         '<up>':    previous_history_item,
         '<down>':  next_history_item,
+        'M-r':     history_search,
         '<tab>':   complete_input,
     }
 
     def __init__(self, *args, **kwargs):
         super(InputBuffer, self).__init__(*args, **kwargs)
-        self._bhistory = []
         self._bhistory_index = -1
         self._saved_buffer = ''
+        self._history_search = None
+
+    def history_key(self):
+        """
+        Returns the name of the history of this buffer. Buffers with the
+        same history key share their history.
+        """
+        return type(self).__name__
+
+    @property
+    def _bhistory(self):
+        return get_history(self.history_key())
 
     @property
     def takes_input(self):
         return True
 
     def buffer(self):
-        return self._buffer
+        return str(self._buffer)
 
     def insert_chars(self, string):
-        self._buffer = self._buffer[:self._cursor] + string + self._buffer[self._cursor:]
+        self._buffer.insert(self._cursor, string)
         self._cursor += len(string)
+        self.on_buffer_changed()
+
+    def insert_paste(self, string):
+        """
+        Insert pasted text. As the input is a single line, line-breaks
+        are replaced by spaces, trailing ones are dropped.
+        """
+        self.insert_chars(re.sub(r'\r\n|[\r\n]', ' ', string.rstrip('\r\n')))
 
     def delete_chars(self, length):
         if self._cursor < len(self._buffer):
-            self._buffer = self._buffer[:self._cursor] + self._buffer[self._cursor + length:]
+            self._buffer.delete(self._cursor, length)
+            self.on_buffer_changed()
 
     def reset_buffer(self, new_content=''):
-        self._buffer = new_content
+        self._buffer.reset(new_content)
         self._cursor = len(self._buffer)
+        self.on_buffer_changed()
 
     @property
     def history_index(self):
@@ -116,15 +169,50 @@ class InputBuffer(WithKeymap):
             return
 
         if self._bhistory_index != -1 and (index == -1 or index == len(self._bhistory)):
-            self._buffer = self._saved_buffer
+            self._buffer.reset(self._saved_buffer)
             self._bhistory_index = -1
         else:
             if self._bhistory_index == -1:
-                self._saved_buffer = self._buffer
+                self._saved_buffer = str(self._buffer)
             self._bhistory_index = index % len(self._bhistory)
-            self._buffer = self._bhistory[self._bhistory_index]
+            self._buffer.reset(self._bhistory[self._bhistory_index])
 
         self.set_cursor(min(self._cursor, len(self._buffer)))
+        self.on_buffer_changed()
+
+    def history_search(self):
+        """
+        Returns a generator running a reverse history search, see
+        ``cui.prompt_string``.
+        """
+        history = self._bhistory
+        if self._history_search is None or self._history_search.history is not history:
+            self._history_search = HistorySearch(history)
+        search = self._history_search
+        # The minibuffer changes its buffer while reading the query
+        buffer, original = self._buffer, str(self._buffer)
+        previous_query = search.query
+
+        def show_match(index):
+            buffer.reset(original if index is None else history[index])
+
+        try:
+            query = yield cui.prompt_string(
+                'History search',
+                default=previous_query,
+                update_fn=lambda query: show_match(search.set_query(query)))
+        except cui.core.RunloopCancel:
+            buffer.reset(original)
+            raise
+        finally:
+            self._cursor = len(self._buffer)
+
+        index = search.set_query(query)
+        if query and query == previous_query:
+            index = search.next_match()
+        show_match(index)
+        self._cursor = len(self._buffer)
+        self.on_buffer_changed()
 
     @property
     def cursor(self):
@@ -137,30 +225,46 @@ class InputBuffer(WithKeymap):
         return False
 
     @classmethod
-    def get_buffer_line(self, prompt, buffer, cursor, show_cursor=False):
-        bstring = buffer + ' '
+    def get_buffer_line(self, prompt, buffer, cursor, show_cursor=False, width=None):
+        """
+        Render ``buffer``, which may be a string or a GapBuffer.
+
+        If ``width`` is provided, only the part of ``buffer`` that fits
+        into ``width`` columns is rendered, scrolled so that the cursor
+        is visible.
+        """
+        length = len(buffer)
+        columns = length + 1 if width is None else max(1, width - len(prompt))
+        if not show_cursor:
+            return [prompt, buffer[:columns]]
+
+        start = max(0, cursor - columns + 1)
+        end = min(length, start + columns)
         return [prompt, [
-            bstring[:cursor],
-            {'content': bstring[cursor],
+            buffer[start:cursor],
+            {'content': buffer[cursor] if cursor < length else ' ',
              'foreground': 'special',
              'background': 'special'},
-            bstring[cursor + 1:]
-        ] if show_cursor else buffer]
+            buffer[cursor + 1:end]
+        ]]
 
-    def buffer_line(self, cursor):
-        bstring = self._buffer + ' '
+    def buffer_line(self, cursor, width=None):
         return [
             str(self._bhistory_index) if self._bhistory_index != -1 else '',
-            *InputBuffer.get_buffer_line(self.prompt, self._buffer, self._cursor, show_cursor=cursor)
+            *InputBuffer.get_buffer_line(self.prompt, self._buffer, self._cursor,
+                                         show_cursor=cursor, width=width)
         ]
 
     def send_current_buffer(self):
-        if self._buffer in self._bhistory:
-            self._bhistory.remove(self._buffer)
-        self._bhistory.append(self._buffer)
+        b = str(self._buffer)
+        history = self._bhistory
+        history.append(b)
+        if history.error:
+            cui.message('Could not save history to %s: %s', history.path, history.error,
+                        level=cui.LOG_WARNING)
+            history.error = None
         self._bhistory_index = -1
-        b = self._buffer
-        self._buffer = ''
+        self._buffer.reset()
         self._cursor = 0
         self.on_send_current_buffer(b)
         self._to_bottom = True
@@ -172,14 +276,27 @@ class InputBuffer(WithKeymap):
         if self._cursor != len(self._buffer):
             return
 
-        self._buffer = self.on_auto_complete()
+        self._buffer.reset(self.on_auto_complete())
         self._cursor = len(self._buffer)
+        self.on_buffer_changed()
 
     def on_auto_complete(self):
-        return self._buffer
+        return str(self._buffer)
+
+    def on_buffer_changed(self):
+        """
+        Called each time the content of the buffer has been edited.
+        """
+        pass
 
 
 class ConsoleBuffer(InputBuffer, ScrollableBuffer):
+    """
+    Buffer displaying a scrollback of previous lines above an input line.
+
+    The number of lines kept in the scrollback can be set via variable
+    scrollback-limit.
+    """
     __keymap__ = {
         'C-d': close_buffer
     }
@@ -187,27 +304,46 @@ class ConsoleBuffer(InputBuffer, ScrollableBuffer):
     def __init__(self, *args):
         super(ConsoleBuffer, self).__init__(*args)
         self._prompt = '> '
-        self._buffer = ''
+        self._buffer = GapBuffer()
         self._cursor = 0
-        self._chistory = []
+        self._chistory = RingBuffer(cui.get_variable(['scrollback-limit']))
         self._to_bottom = False
 
     @property
     def prompt(self):
         return self._prompt
 
-    def get_lines(self, window):
+    def on_pre_render(self):
+        self._chistory.maxlen = cui.get_variable(['scrollback-limit'])
+
+    def on_pre_render_win(self, window):
+        self.keep_position(window)
         if window == cui.selected_window() and self._to_bottom:
-            first_row = max(self.line_count() - window.dimensions[0], 0)
-            self.set_variable(['win/buf', 'first-row'], first_row)
+            self.scroll_to_bottom(window)
             self._to_bottom = False
 
-        yield from iter(self._chistory[window._state['first-row']:])
-        yield self.buffer_line(cursor=True)
+    def get_line(self, window, index):
+        if index < len(self._chistory):
+            return self._chistory[index]
+        return self.buffer_line(cursor=True)
+
+    def get_lines(self, window):
+        first_row = window._state['first-row']
+        yield from self._chistory.islice(first_row, first_row + window.rows)
+        yield self.buffer_line(cursor=True, width=window.columns)
 
     def line_count(self):
         return len(self._chistory) + 1
 
+    def dropped_lines(self):
+        return self._chistory.dropped
+
+    def search_count(self):
+        return len(self._chistory)
+
+    def search_text(self, index):
+        return line_text(self._chistory[index])
+
     def send_current_buffer(self):
         self._chistory.append(self.buffer_line(cursor=False))
         super(ConsoleBuffer, self).send_current_buffer()
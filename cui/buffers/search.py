@@ -0,0 +1,177 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides incremental search in buffers.
+
+A searchable buffer provides a number of units (lines or items) via
+``search_count``, the text of each unit via ``search_text(index)``,
+the index of the currently displayed unit via ``search_position`` and
+a method ``search_goto(index)`` to display a unit.
+"""
+
+import bisect
+import re
+import time
+
+import cui
+
+from cui.util import highlight_spans, line_text
+
+HIGHLIGHT_STYLE = {'foreground': 'search', 'background': 'search'}
+
+
+class Search(object):
+    """
+    The state of an incremental search in ``buffer_object``.
+
+    Units are scanned in time slices starting at the origin of the
+    search, in the direction of the search and wrapping around at the
+    end of the buffer. Indices of matching units are kept in a sorted
+    list, so once the scan is complete, finding the next or previous
+    match is O(log n). Before, the scan is restarted after the current
+    match, displaying the first match found.
+    """
+
+    def __init__(self, buffer_object):
+        self._buffer = buffer_object
+        self.query = ''
+        self.active = False
+        self._pattern = None
+        self._matches = []
+        self._ranges = []
+        self._count = 0
+        self._timer = None
+        self._origin = 0
+        self._backward = False
+        self._jump = False
+        self._report = False
+
+    def start(self, backward):
+        # The buffer may have changed since the last search, so matches
+        # are not reused, even if the query is the same
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._pattern = None
+        self._matches = []
+        self._ranges = []
+        self.active = True
+        self._origin = self._buffer.search_position()
+        self._backward = backward
+
+    def stop(self):
+        self.active = False
+
+    def set_query(self, query):
+        """
+        Search for the regular expression ``query``, which is matched
+        ignoring case if it contains no upper case characters.
+        """
+        if query == self.query and self._pattern is not None:
+            return
+        self.query = query
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._matches = []
+        self._ranges = []
+        try:
+            self._pattern = re.compile(query, 0 if query.lower() != query else re.IGNORECASE) \
+                            if query else None
+        except re.error:
+            self._pattern = None
+        if self._pattern is None:
+            self._buffer.search_goto(self._origin)
+            return
+
+        self._start_scan(self._origin, self._backward)
+
+    def _start_scan(self, start, backward):
+        """
+        Scan all units starting at ``start``, and display the first match.
+        """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        count = self._buffer.search_count()
+        self._count = count
+        self._matches = []
+        if backward:
+            start = min(start, count - 1)
+            self._ranges = [range(start, -1, -1), range(count - 1, start, -1)]
+        else:
+            start = max(0, min(start, count))
+            self._ranges = [range(start, count), range(0, start)]
+        self._jump = True
+        self._scan()
+
+    def _scan(self):
+        """
+        Scan the pending ranges of units. The scan is interrupted after
+        the time set in variable time-slice and continued on the next
+        iteration of the event-loop.
+        """
+        self._timer = None
+        deadline = time.monotonic() + cui.get_variable(['time-slice'])
+        while self._ranges:
+            units = self._ranges.pop(0)
+            found = []
+            for i, index in enumerate(units):
+                if self._pattern.search(self._buffer.search_text(index) or ''):
+                    found.append(index)
+                    if self._jump:
+                        self._jump = False
+                        self._buffer.search_goto(index)
+                if time.monotonic() > deadline:
+                    self._ranges.insert(0, units[i + 1:])
+                    break
+            self._add_matches(found)
+            if time.monotonic() > deadline:
+                self._timer = cui.add_timer(0, self._scan)
+                return
+        if self._report and self._jump:
+            cui.message('No match for %s' % self.query)
+        self._report = False
+
+    def _add_matches(self, found):
+        # Scanned ranges are disjoint, so no known match lies between
+        # the indices found, and these can be inserted at once.
+        if not found:
+            return
+        if found[0] > found[-1]:
+            found.reverse()
+        position = bisect.bisect_left(self._matches, found[0])
+        self._matches[position:position] = found
+
+    def next_match(self, backward=False):
+        """
+        Display the next match after (or before) the current position,
+        wrapping around at the end of the buffer.
+        """
+        if self._pattern is None:
+            return
+        position = self._buffer.search_position()
+        if self._ranges or self._count != self._buffer.search_count():
+            # Matches between the current one and the next may not be
+            # known yet, continue with the first match found
+            self._report = True
+            self._start_scan(position - 1 if backward else position + 1, backward)
+            return
+        if not self._matches:
+            cui.message('No match for %s' % self.query)
+            return
+
+        if backward:
+            index = bisect.bisect_left(self._matches, position) - 1
+        else:
+            index = bisect.bisect_right(self._matches, position)
+        self._buffer.search_goto(self._matches[index % len(self._matches)])
+
+    def highlight(self, line):
+        if not self.active or self._pattern is None:
+            return line
+        spans = [match.span() for match in self._pattern.finditer(line_text(line))
+                 if match.end() > match.start()]
+        return highlight_spans(line, spans, HIGHLIGHT_STYLE) if spans else line
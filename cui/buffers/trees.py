@@ -4,12 +4,16 @@
 
 import cui
 import functools
+import itertools
+import time
+import weakref
 
 from .base import ListBuffer
 from .util import with_current_buffer
 from cui import symbols
 from cui.meta import combine_meta_classes
-from cui.util import find_value
+from cui.util import find_value, line_text
+from cui.util.row_index import RowIndex
 
 
 @with_current_buffer
@@ -17,9 +21,12 @@ def expand_node(b):
     """
     Expand the currently selected node.
     """
+    if b.selected_node().get('loading'):
+        return
     item = b.selected_item()
     if not b.is_expanded(item) and b.has_children(item):
         b.set_expanded(item, True)
+        b.invalidate_node(b.selected_node())
 
 
 @with_current_buffer
@@ -27,21 +34,84 @@ def collapse_node(b):
     """
     Collapse the currently selected node.
     """
+    if b.selected_node().get('loading'):
+        return
     item = b.selected_item()
     if b.is_expanded(item) and b.has_children(item):
         b.set_expanded(item, False)
+        b.invalidate_node(b.selected_node())
+
+
+@with_current_buffer
+def filter_tree(b):
+    """
+    Narrow the displayed nodes to those matching a pattern, while
+    keeping their ancestors. The tree is filtered while typing, an
+    empty pattern displays all nodes again.
+    """
+    query = b.filter_query()
+    try:
+        b.set_filter((yield cui.prompt_string('Filter', default=query, update_fn=b.set_filter)))
+    except cui.core.RunloopCancel:
+        b.set_filter(query)
+        raise
+
+
+class _VirtualRows(object):
+    """
+    Sequence of the nodes displayed by a virtual TreeBuffer.
+    """
+
+    def __init__(self, buffer_object):
+        self._buffer = buffer_object
+
+    def __len__(self):
+        return self._buffer._virtual_row_count()
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if row < 0 or row >= len(self):
+            raise IndexError('Row %s out of range.' % row)
+        return self._buffer._virtual_node(row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
 
 
 class TreeBuffer(ListBuffer):
+    """
+    Displays a hierarchy of items, whose children can be expanded.
+
+    By default the visible nodes are flattened into a list before each
+    render. If ``virtual`` is set, only the number of visible rows of
+    expanded subtrees is kept, and the nodes displayed in a window are
+    resolved by descending the tree. In this mode, code that modifies
+    the tree must call ``invalidate_node`` for the modified node, or
+    ``invalidate_tree`` if roots have changed.
+
+    The displayed nodes may be filtered by calling ``set_filter``. The
+    filter is applied to the nodes visible when it is set, in time slices
+    of at most ``time-slice`` seconds. If the query extends the previous
+    query, only the nodes that matched before are tested again.
+    """
+
     __keymap__ = {
-        '<left>': collapse_node,
-        '<right>': expand_node
+        '<left>':  collapse_node,
+        '<right>': expand_node,
+        '/':       filter_tree
     }
 
-    def __init__(self, *args, show_handles=False):
+    def __init__(self, *args, show_handles=False, virtual=False):
         super(TreeBuffer, self).__init__(*args)
         self._flattened = []
         self._show_handles = show_handles
+        self._fetches = {}
+        self._virtual = virtual
+        self._virtual_rows = _VirtualRows(self)
+        self._filter = None
+        self.invalidate_tree()
 
     def get_children(self, item):
         return []
@@ -56,37 +126,375 @@ class TreeBuffer(ListBuffer):
         False
 
     def fetch_children(self, item):
+        """
+        Make the children of ``item`` available via ``get_children``.
+
+        To fetch children asynchronously, return a future (any object
+        providing ``add_done_callback``, ``done``, ``cancelled`` and
+        ``exception``, e.g., ``concurrent.futures.Future``) that is
+        completed once the children are available. While the future is
+        pending a placeholder is displayed and ``fetch_children`` will
+        not be invoked again for ``item``.
+        """
         pass
 
     def _fetch_children(self, item):
-        self.fetch_children(item)
+        """
+        Returns the children of ``item`` or ``None`` if an asynchronous
+        fetch for ``item`` is still pending.
+        """
+        fetch = self._fetches.get(id(item))
+        if fetch is None:
+            fetch = self.fetch_children(item)
+            if not hasattr(fetch, 'add_done_callback'):
+                return self.get_children(item)
+            self._fetches[id(item)] = fetch
+            # Done callbacks may run on any thread
+            fetch.add_done_callback(
+                functools.partial(cui.call_in_event_loop, self._children_fetched, item))
+        if not fetch.done():
+            return None
+        return self._finish_fetch(item)
+
+    def _finish_fetch(self, item):
+        fetch = self._fetches.pop(id(item))
+        if fetch.cancelled() or fetch.exception() is not None:
+            cui.message('Could not fetch children of %s: %s'
+                        % (item, 'cancelled' if fetch.cancelled() else fetch.exception()))
+            self.set_expanded(item, False)
+            return []
         return self.get_children(item)
 
+    def _children_fetched(self, item, future):
+        loading_vnodes = self._loading_vnodes.pop(id(item), [])
+        # The fetch may have been finished by a render already
+        if self._fetches.get(id(item)) is not future:
+            return
+        self._finish_fetch(item)
+        for vnode in loading_vnodes:
+            if self._is_attached(vnode):
+                self._invalidate_vnode(item, vnode['parent'], vnode['index'])
+
     def get_roots(self):
         return []
 
+    def _child_guide(self, parent):
+        # The tree guide shared by all children of parent, which
+        # is nested, so it is built in constant time per level
+        if parent is None:
+            return []
+        if 'child_guide' not in parent:
+            parent['child_guide'] = [parent['guide']] + self._child_guide_tail(parent)
+        return parent['child_guide']
+
+    def _child_guide_tail(self, parent):
+        if parent['depth'] == 0:
+            return ['  '] if self._show_handles else [' ']
+        return (['  '] if parent['last'] else [symbols.SYM_VLINE, ' ']) + \
+               ([' '] if self._show_handles else [])
+
+    def _create_internal_nodes(self, nodes, parent=None):
+        guide = self._child_guide(parent)
+        depth = 0 if parent is None else parent['depth'] + 1
+        return list(map(lambda n: {'item': n,
+                                   'first': n == nodes[0],
+                                   'last': n == nodes[-1],
+                                   'parent': parent,
+                                   'depth': depth,
+                                   'guide': guide},
+                        nodes))
+
+    def _create_loading_node(self, parent):
+        return {'item': None,
+                'loading': True,
+                'first': True,
+                'last': True,
+                'parent': parent,
+                'depth': parent['depth'] + 1,
+                'guide': self._child_guide(parent)}
+
+    def invalidate_tree(self):
+        """
+        Discard all information on the displayed nodes of a virtual tree.
+        """
+        self._vroot = None
+        self._loading_vnodes = {}
+        self._vnode_cache = {}
+
+    def invalidate_node(self, node):
+        """
+        Notify the buffer that the expansion state or the children of
+        the item displayed by ``node`` have changed.
+        """
+        if not self._virtual or self._vroot is None or node.get('loading'):
+            return
+        parent_vnode = self._find_vnode(node['parent'])
+        if parent_vnode is not None:
+            self._invalidate_vnode(node['item'], parent_vnode, node['index'])
+
+    def _find_vnode(self, node):
+        """
+        Returns the vnode of the item displayed by ``node``, or the root
+        vnode if ``node`` is None. Vnodes are located by position, as an
+        item may be displayed by several nodes.
+        """
+        path = []
+        while node is not None:
+            path.append(node['index'])
+            node = node['parent']
+        vnode = self._vroot
+        for index in reversed(path):
+            vnode = vnode['vnodes'].get(index)
+            if vnode is None:
+                return None
+        return vnode
+
+    def _is_attached(self, vnode):
+        while vnode['parent'] is not None:
+            if vnode['parent']['vnodes'].get(vnode['index']) is not vnode:
+                return False
+            vnode = vnode['parent']
+        return vnode is self._vroot
+
+    def _invalidate_vnode(self, item, parent_vnode, index):
+        old_vnode = parent_vnode['vnodes'].pop(index, None)
+        delta = 0
+        if old_vnode:
+            delta -= self._vnode_row_count(old_vnode)
+        if self.has_children(item) and self.is_expanded(item):
+            delta += self._vnode_row_count(self._build_vnode(item, parent_vnode, index))
+
+        vnode = parent_vnode
+        while vnode is not None:
+            vnode['rows'].update(index, delta)
+            index = vnode['index']
+            vnode = vnode['parent']
+        self._vnode_cache = {}
+
+    def _build_vnode(self, item, parent, index):
+        if parent is None:
+            children = self.get_roots()
+        else:
+            children = self.get_children(item) or self._fetch_children(item)
+        # Vnodes of expanded children are kept by child index
+        vnode = {'item': item,
+                 'parent': parent,
+                 'index': index,
+                 'loading': children is None,
+                 'children': children or [],
+                 'vnodes': {}}
+        if parent is not None:
+            parent['vnodes'][index] = vnode
+        if children is None:
+            self._loading_vnodes.setdefault(id(item), []).append(vnode)
+
+        counts = []
+        for child_index, child in enumerate(vnode['children']):
+            if self.has_children(child) and self.is_expanded(child):
+                counts.append(1 + self._vnode_row_count(
+                    self._build_vnode(child, vnode, child_index)))
+            else:
+                counts.append(1)
+        vnode['rows'] = RowIndex(counts)
+        return vnode
+
+    def _vnode_row_count(self, vnode):
+        return vnode['rows'].total + (1 if vnode['loading'] else 0)
+
+    def _virtual_row_count(self):
+        if self._vroot is None:
+            self._vroot = self._build_vnode(None, None, None)
+        return self._vnode_row_count(self._vroot)
+
+    def _create_virtual_node(self, vnode, index, parent):
+        children = vnode['children']
+        return {'item': children[index],
+                'first': index == 0,
+                'last': index == len(children) - 1,
+                'parent': parent,
+                'depth': 0 if parent is None else parent['depth'] + 1,
+                'guide': self._child_guide(parent),
+                'index': index}
+
+    def _virtual_node(self, row):
+        vnode = self._vroot
+        parent = None
+        while True:
+            if vnode['loading']:
+                return self._create_loading_node(parent)
+            index, row = vnode['rows'].find(row)
+            key = (id(vnode), index)
+            node = self._vnode_cache.get(key)
+            if node is None:
+                node = self._create_virtual_node(vnode, index, parent)
+                self._vnode_cache[key] = node
+            if row == 0:
+                return node
+            vnode = vnode['vnodes'][index]
+            parent = node
+            row -= 1
+
+    def _iter_virtual_nodes(self):
+        self._virtual_row_count()
+        stack = [(self._vroot, None, 0)]
+        while stack:
+            vnode, parent, index = stack.pop()
+            if index >= len(vnode['children']):
+                continue
+            stack.append((vnode, parent, index + 1))
+            node = self._create_virtual_node(vnode, index, parent)
+            yield node
+            child_vnode = vnode['vnodes'].get(index)
+            if child_vnode is not None:
+                stack.append((child_vnode, node, 0))
+
+    def _node_row(self, node):
+        if not self._virtual:
+            return next((row for row, n in enumerate(self._flattened)
+                         if n['item'] is node['item'] and n['depth'] == node['depth']),
+                        None)
+        row = 0
+        while node is not None:
+            parent = node['parent']
+            vnode = self._find_vnode(parent)
+            if vnode is None:
+                return None
+            row += vnode['rows'].prefix(node['index']) + (0 if parent is None else 1)
+            node = parent
+        return row
+
+    # ---------------------- Filtering --------------------------
+
+    def filter_query(self):
+        return self._filter['query'] if self._filter else ''
+
+    def set_filter(self, query):
+        """
+        Display only nodes whose rendered text contains ``query`` (ignoring
+        case), and their ancestors. An empty query removes the filter.
+        """
+        previous = self._filter
+        if previous and previous['query'] == query:
+            return
+        if previous and previous['timer']:
+            previous['timer'].cancel()
+        if not query:
+            self.clear_filter()
+            return
+
+        if previous and previous['query'].lower() in query.lower():
+            # Nodes that did not match before, can not match now
+            candidates = itertools.chain(previous['matched'], previous['candidates'])
+        else:
+            candidates = self._iter_virtual_nodes() if self._virtual else iter(self._flattened)
+        self._filter = {
+            'query':      query,
+            'pattern':    query.lower(),
+            'candidates': candidates,
+            'matched':    [],
+            'nodes':      [],
+            'copies':     {},
+            'last_child': {},
+            'window':     cui.buffer_window(self) or cui.selected_window(),
+            'timer':      None
+        }
+        self.set_variable(['win/buf', 'selected-item'], 0)
+        self._filter_step(self._filter)
+
+    def clear_filter(self):
+        if self._filter is None:
+            return
+        if self._filter['timer']:
+            self._filter['timer'].cancel()
+        selected_node = self.selected_node() if self._filter['nodes'] else None
+        self._filter = None
+        row = self._node_row(selected_node) if selected_node else None
+        self.set_variable(['win/buf', 'selected-item'], row or 0)
+        self.recenter()
+
+    def _filter_step(self, filter_):
+        filter_['timer'] = None
+        deadline = time.monotonic() + cui.get_variable(['time-slice'])
+        filter_['window'] = cui.buffer_window(self) or filter_['window']
+        for node in filter_['candidates']:
+            if self._filter_matches(filter_, node):
+                filter_['matched'].append(node)
+                self._add_filtered_node(filter_, node)
+            if time.monotonic() > deadline:
+                filter_['timer'] = cui.add_timer(0, functools.partial(self._filter_step,
+                                                                      filter_))
+                return
+
+    def _filter_matches(self, filter_, node):
+        item = node['item']
+        if node.get('loading'):
+            return False
+        # The text is kept with the node, as extended queries test the
+        # same nodes again
+        text = node.get('filter_text')
+        if text is None:
+            window = filter_['window']
+            text = line_text(self.render_node(window, item, node['depth'],
+                                              window.dimensions[1])).lower()
+            node['filter_text'] = text
+        return filter_['pattern'] in text
+
+    def _add_filtered_node(self, filter_, node):
+        # Nodes are visited in display order, so missing ancestors are
+        # always located between the last added node and node.
+        path = []
+        while node is not None and id(node) not in filter_['copies']:
+            path.append(node)
+            node = node['parent']
+        parent = None if node is None else filter_['copies'][id(node)]
+        for node in reversed(path):
+            parent = self._copy_filtered_node(filter_, node, parent)
+            filter_['copies'][id(node)] = parent
+            filter_['nodes'].append(parent)
+
+    def _copy_filtered_node(self, filter_, node, parent):
+        """
+        Copy ``node`` to display it as the last filtered child of
+        ``parent``, with the tree guide of the filtered tree.
+        """
+        previous = filter_['last_child'].get(id(parent))
+        if previous is not None:
+            previous['last'] = False
+            if 'child_guide' in previous:
+                # Guides of descendants nest this list, update them all
+                previous['child_guide'][1:] = self._child_guide_tail(previous)
+        copy = dict(node,
+                    parent=parent,
+                    first=previous is None,
+                    last=True,
+                    guide=self._child_guide(parent))
+        copy.pop('child_guide', None)
+        filter_['last_child'][id(parent)] = copy
+        return copy
+
     def on_pre_render(self):
-        self._flattened = []
-        def _create_internal_nodes(nodes, parent=None):
-            return list(map(lambda n: {'item': n,
-                                       'first': n == nodes[0],
-                                       'last': n == nodes[-1],
-                                       'parent': parent,
-                                       'depth': 0 if parent is None else parent['depth'] + 1},
-                            nodes))
+        if self._virtual:
+            self._vnode_cache = {}
+            self._virtual_row_count()
+            return
 
+        self._flattened = []
         roots = self.get_roots()
-        node_stack = _create_internal_nodes(roots)
+        node_stack = self._create_internal_nodes(roots)
         while node_stack:
             n = node_stack.pop(0)
             self._flattened.append(n)
             if self.has_children(n['item']) and self.is_expanded(n['item']):
-                node_stack[0:0] = _create_internal_nodes(self.get_children(n['item']) or \
-                                                         self._fetch_children(n['item']),
-                                                         n)
+                children = self.get_children(n['item']) or self._fetch_children(n['item'])
+                if children is None:
+                    self._flattened.append(self._create_loading_node(n))
+                else:
+                    node_stack[0:0] = self._create_internal_nodes(children, n)
 
     def items(self):
-        return self._flattened
+        if self._filter is not None:
+            return self._filter['nodes']
+        return self._virtual_rows if self._virtual else self._flattened
 
     def selected_node(self):
         return super(TreeBuffer, self).selected_item()
@@ -96,6 +504,9 @@ class TreeBuffer(ListBuffer):
 
     def render_item(self, window, item, index):
         tree_tab = cui.get_variable(['tree-tab'])
+        if item.get('loading'):
+            return [[self.render_tree_tab(window, item, None, tree_tab, True),
+                     {'content': 'loading...', 'foreground': 'inactive'}]]
         rendered_node = self.render_node(window, item['item'], item['depth'],
                                          window.dimensions[1] - tree_tab * item['depth'])
         return [[self.render_tree_tab(window, item, line, tree_tab, line == rendered_node[0]),
@@ -103,7 +514,7 @@ class TreeBuffer(ListBuffer):
                 for line in rendered_node]
 
     def render_tree_tab(self, window, item, line, tree_tab, first_line):
-        lst = []
+        lst = [item['guide']]
 
         if item['depth'] != 0:
             lst.append((symbols.SYM_LLCORNER if item['last'] else symbols.SYM_LTEE) \
@@ -111,18 +522,10 @@ class TreeBuffer(ListBuffer):
                        (' ' if item['last'] else symbols.SYM_VLINE))
         if self._show_handles:
             lst.append((symbols.SYM_DARROW if self.is_expanded(item['item']) else symbols.SYM_RARROW) \
-                       if first_line and self.has_children(item['item']) else \
+                       if first_line and not item.get('loading') and self.has_children(item['item']) else \
                        ' ')
         lst.append(' ')
 
-        while item['depth'] > 1:
-            item = item['parent']
-            lst = (['  '] if item['last'] else [symbols.SYM_VLINE, ' ']) + \
-                  ([' '] if self._show_handles else []) + \
-                  lst
-        if item['depth'] == 1:
-            lst = (['  '] if self._show_handles else [' ']) + lst
-
         return lst
 
     def render_node(self, window, item, depth, width):
@@ -157,16 +560,25 @@ def node_handlers(*nrs):
     return _node_handlers
 
 
-def NodeHandler(is_expanded_=False, has_children_=False):
+def NodeHandler(is_expanded_=False, has_children_=False, types_=None):
+    """
+    Create a base class for node handlers.
+
+    If ``types_`` is a type or a tuple of types, the handler is selected
+    for all items that are instances of these types, without consulting
+    ``matches``. This allows DefaultTreeBuffer to resolve handlers once
+    per item type.
+    """
     class _NodeHandler(object):
         IS_EXPANDED = is_expanded_
         HAS_CHILDREN = has_children_
+        TYPES = types_
         def __init__(self, *args, **kwargs):
             self.args = args
             self.kwargs = kwargs
 
         def matches(self, item):
-            return False
+            return self.TYPES is not None and isinstance(item, self.TYPES)
 
         def is_expanded(self, item):
             return _NodeHandler.IS_EXPANDED
@@ -191,26 +603,78 @@ def NodeHandler(is_expanded_=False, has_children_=False):
 class DefaultTreeBuffer(TreeBuffer,
                         metaclass=combine_meta_classes(DefaultTreeBufferMeta,
                                                        TreeBuffer.__class__)):
+    """
+    A TreeBuffer delegating to the first of its node handlers matching
+    an item.
+
+    Handlers declaring ``TYPES`` are resolved once per item type. Other
+    handlers are resolved via ``matches`` and cached for as long as the
+    item lives, which requires items that can be weakly referenced.
+    Instances of ``dict``, ``list``, ``tuple``, ``str``, ``int`` and
+    other builtin types can not, so their resolution is only cached
+    for a single render. Prefer ``TYPES`` for handlers of such items.
+    """
+
     def __init__(self, *args, **kwargs):
         super(DefaultTreeBuffer, self).__init__(*args, **kwargs)
         self._node_handlers = [handler(*args, **kwargs)
                                for handler in self.__node_handlers__]
+        self.invalidate_node_handlers()
 
     def on_pre_render(self):
-        # Invalidate handler-cache
-        self._node_handler_cache = {}
+        # Items that can not be weakly referenced may be freed and
+        # their ids reused, so their handlers are cached per frame only
+        self._node_handler_frame_cache = {}
         super(DefaultTreeBuffer, self).on_pre_render()
 
+    def invalidate_node_handlers(self):
+        """
+        Drop all cached handler resolutions. Call this if the result of
+        a handler's ``matches`` changes for items that have already
+        been displayed.
+        """
+        self._node_handler_type_cache = {}
+        self._node_handler_cache = {}
+        self._node_handler_frame_cache = {}
+
+    def _find_type_handler(self, item_type):
+        # Resolution only depends on the type of item, if a handler
+        # declaring TYPES matches before any handler that does not.
+        for handler in self._node_handlers:
+            if handler.TYPES is None:
+                return None
+            if issubclass(item_type, handler.TYPES):
+                return handler
+        return None
+
     def _get_handler(self, item):
+        item_type = type(item)
+        if item_type in self._node_handler_type_cache:
+            handler = self._node_handler_type_cache[item_type]
+        else:
+            handler = self._find_type_handler(item_type)
+            self._node_handler_type_cache[item_type] = handler
+        if handler is not None:
+            return handler
+
         item_id = id(item)
-        if item_id in self._node_handler_cache:
-            return self._node_handler_cache[item_id]
+        cached = self._node_handler_cache.get(item_id)
+        if cached is not None:
+            return cached[1]
+        if item_id in self._node_handler_frame_cache:
+            return self._node_handler_frame_cache[item_id]
 
         handler = find_value(self._node_handlers,
                              lambda handler, _: handler.matches(item))
         if handler is None:
             raise ValueError('No NodeHandler found for %s' % repr(item))
-        self._node_handler_cache[item_id] = handler
+
+        cache = self._node_handler_cache
+        try:
+            cache[item_id] = (weakref.ref(item, lambda _: cache.pop(item_id, None)),
+                              handler)
+        except TypeError:
+            self._node_handler_frame_cache[item_id] = handler
 
         return handler
 
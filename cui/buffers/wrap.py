@@ -0,0 +1,142 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides soft wrapping of lines in buffers.
+
+A buffer supporting soft wrapping provides random access to its lines
+via ``get_line(window, index)``.
+"""
+
+import cui
+
+from cui.util import line_text, slice_line, wrap_points
+from cui.util.row_index import RowIndex
+
+
+class SoftWrap(object):
+    """
+    Maps rows of a window to the wrapped lines of ``buffer_object``.
+
+    Wrap points are computed when a line is displayed or scrolled over,
+    and cached together with the text of the line, until the width of
+    the window changes. Lines not wrapped yet are assumed to be displayed
+    in one row. The number of rows of each line is kept in a RowIndex,
+    so that converting between rows and lines is O(log n).
+    """
+
+    def __init__(self, buffer_object):
+        self._buffer = buffer_object
+        self._width = None
+        self._wraps = {}
+        self._rows = RowIndex([])
+
+    def _sync(self, window):
+        count = self._buffer.line_count()
+        if window.columns != self._width or count < len(self._rows):
+            self._width = window.columns
+            self._wraps = {}
+            self._rows = RowIndex([1] * count)
+        while len(self._rows) < count:
+            self._rows.append(1)
+
+    def _wrap(self, window, index, line):
+        text = line_text(line)
+        cached = self._wraps.get(index)
+        if cached is not None and cached[0] == text:
+            return cached[1]
+
+        points = wrap_points(text, max(1, self._width), cui.get_variable(['tab-stop']))
+        previous = len(cached[1]) + 1 if cached else 1
+        self._wraps[index] = (text, points)
+        self._rows.update(index, len(points) + 1 - previous)
+        return points
+
+    def _line_rows(self, window, index):
+        return len(self._wrap(window, index, self._buffer.get_line(window, index))) + 1
+
+    def row_count(self, window):
+        self._sync(window)
+        return self._rows.total
+
+    def drop_lines(self, count):
+        """
+        Discard the first ``count`` lines, which have been removed from
+        the buffer. Returns the number of rows they were displayed in.
+        """
+        count = min(count, len(self._rows))
+        rows = self._rows.prefix(count)
+        self._rows = RowIndex([len(self._wraps[index][1]) + 1 if index in self._wraps else 1
+                               for index in range(count, len(self._rows))])
+        self._wraps = {index - count: wrap
+                       for index, wrap in self._wraps.items() if index >= count}
+        return rows
+
+    def line_index(self, window, row):
+        """
+        Returns the index of the line displayed at ``row``.
+        """
+        self._sync(window)
+        return min(self._rows.find(row)[0], max(0, len(self._rows) - 1))
+
+    def line_row(self, window, index):
+        """
+        Returns the first row displaying line ``index``.
+        """
+        self._sync(window)
+        if index < len(self._rows):
+            self._line_rows(window, index)
+        return self._rows.prefix(index)
+
+    def move(self, window, row, delta):
+        """
+        Returns the row ``delta`` rows from ``row``, wrapping the lines
+        scrolled over.
+        """
+        self._sync(window)
+        count = len(self._rows)
+        if count == 0:
+            return 0
+        index, offset = self._rows.find(row)
+        if index >= count:
+            index, offset = count - 1, self._line_rows(window, count - 1) - 1
+
+        if delta < 0:
+            remaining = -delta - offset
+            while remaining > 0 and index > 0:
+                index -= 1
+                remaining -= self._line_rows(window, index)
+            return self._rows.prefix(index) - min(0, remaining)
+
+        remaining = offset + delta
+        while index < count - 1:
+            rows = self._line_rows(window, index)
+            if remaining < rows:
+                break
+            remaining -= rows
+            index += 1
+        rows = self._line_rows(window, index)
+        return self._rows.prefix(index) + min(remaining, rows - 1)
+
+    def get_rows(self, window, first_row, transform=None):
+        """
+        Yield the rows displayed in ``window``, starting at ``first_row``.
+        ``transform`` is applied to each line before it is wrapped.
+        """
+        self._sync(window)
+        index, offset = self._rows.find(first_row)
+        rows = 0
+        while rows < window.rows and index < len(self._rows):
+            line = self._buffer.get_line(window, index)
+            points = self._wrap(window, index, line)
+            if transform:
+                line = transform(line)
+            bounds = [0] + points + [None]
+            for start, end in zip(bounds[offset:-1], bounds[offset + 1:]):
+                if rows == window.rows:
+                    return
+                yield slice_line(line, start, end) if points else line
+                rows += 1
+            index += 1
+            offset = 0
@@ -2,11 +2,19 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import array
+import itertools
 import json
+import mmap
+import os
+import threading
+import time
 
 from cui import api
 from cui import buffers
 from cui import core
+from cui.util import inotify, line_text
+from cui.util.ring_buffer import RingBuffer
 
 
 @buffers.with_current_buffer
@@ -73,6 +81,15 @@ class HelpBuffer(buffers.ScrollableBuffer):
     def line_count(self):
         return len(self._lines)
 
+    def search_count(self):
+        return len(self._lines)
+
+    def search_text(self, index):
+        return line_text(self._lines[index])
+
+    def get_line(self, window, index):
+        return self._lines[index]
+
     def get_lines(self, window):
         yield from iter(self._lines[window._state['first-row']:])
 
@@ -108,23 +125,164 @@ class EvalBuffer(buffers.ConsoleBuffer):
             self.extend(str(result))
 
 
+class _LogView(object):
+    """
+    Records paged in from disk, followed by the records in memory.
+    """
+
+    def __init__(self, paged, records):
+        self._paged = paged
+        self._records = records
+
+    def __len__(self):
+        return len(self._paged) + len(self._records)
+
+    def __getitem__(self, index):
+        if index < len(self._paged):
+            return self._paged[index]
+        return self._records[index - len(self._paged)]
+
+
+@buffers.with_current_buffer
+def filter_log_level(buffer_object):
+    """
+    Only display messages of the entered log level or above.
+    """
+    buffer_object.set_level((
+        yield api.prompt_string('Log level',
+                                default=buffer_object.level_name(),
+                                complete_fn=api.complete_from_list(lambda: core.LOG_LEVELS.keys()))))
+
+
 @api.buffer_keys('C-x C-l', 'show_log')
 class LogBuffer(buffers.ListBuffer):
     """
     Displays messages posted via cui.message or cui.exception.
 
-    The maximum can be set via variable message-limit.
+    The maximum can be set via variable message-limit. Use l to
+    display only messages of a minimum log level.
+
+    If a log file is enabled, scrolling past the first message pages
+    older messages back in from disk. Messages dropped from memory
+    while these are displayed, are kept with them.
     """
 
+    PAGE_SIZE = 100
+
+    __keymap__ = {
+        'l': filter_log_level
+    }
+
     @classmethod
     def name(cls, **kwargs):
         return "Logger"
 
+    def __init__(self, *args):
+        super(LogBuffer, self).__init__(*args)
+        self._level = core.LOG_DEBUG
+        self._filtered = []
+        self._filtered_level = None
+        self._filtered_count = 0
+        self._paged = []
+        self._paged_filtered = []
+        self._paged_key = None
+        self._paged_seq = None
+        self._page_position = None
+
+    def level_name(self):
+        return next(name for name, level in core.LOG_LEVELS.items()
+                    if level == self._level)
+
+    def set_level(self, level_name):
+        if level_name not in core.LOG_LEVELS:
+            api.message('Unknown log level: %s', level_name)
+            return
+        self._level = core.LOG_LEVELS[level_name]
+
+    def item_up(self, step=1):
+        selected = self.get_variable(['win/buf', 'selected-item'])
+        if step > selected:
+            self.set_variable(['win/buf', 'selected-item'], selected + self._page_in())
+        super(LogBuffer, self).item_up(step)
+
+    def _page_in(self):
+        logger = core.Core().logger
+        if logger.archive is None:
+            return 0
+
+        first_seq = logger.appended - len(logger.messages)
+        self._keep_dropped(logger, first_seq)
+        if not self._paged:
+            self._paged_seq = first_seq
+            self._page_position = None
+        records, self._page_position = logger.archive.records_before(
+            self._page_position, LogBuffer.PAGE_SIZE, first_seq)
+        self._paged[:0] = records
+        self._paged_key = None
+        return sum(1 for r in records if r.level >= self._level)
+
+    def _keep_dropped(self, logger, first_seq):
+        """
+        Append the records, which have been dropped from memory since
+        the last call, to the paged records. If these have not been
+        written to disk yet, the paged records are discarded instead.
+        """
+        if not self._paged or first_seq == self._paged_seq:
+            return
+
+        count = first_seq - self._paged_seq
+        records, _ = logger.archive.records_before(None, count, first_seq)
+        written = [r.seq for r in records] == list(range(self._paged_seq, first_seq))
+        self._paged_seq = first_seq
+        if written:
+            self._paged.extend(records)
+            self._paged_key = None
+            return
+
+        removed = sum(1 for r in self._paged if r.level >= self._level)
+        self._paged = []
+        self._paged_key = None
+        selected = self.get_variable(['win/buf', 'selected-item'])
+        self.set_variable(['win/buf', 'selected-item'], max(0, selected - removed))
+
     def items(self):
-        return core.Core().logger.messages
+        logger = core.Core().logger
+        self._keep_dropped(logger, logger.appended - len(logger.messages))
+        if not self._paged:
+            return self._live_items(logger)
+
+        if self._paged_key != self._level:
+            self._paged_filtered = [r for r in self._paged if r.level >= self._level]
+            self._paged_key = self._level
+        return _LogView(self._paged_filtered, self._live_items(logger))
+
+    def _live_items(self, logger):
+        if self._level <= core.LOG_DEBUG:
+            return logger.messages
+
+        # Only filter records appended since the last call
+        if self._filtered_level != self._level:
+            self._filtered = [r for r in logger.messages if r.level >= self._level]
+            self._filtered_level = self._level
+        else:
+            new_count = logger.appended - self._filtered_count
+            self._filtered.extend(r for r in logger.messages.islice(len(logger.messages) - new_count)
+                                  if r.level >= self._level)
+        self._filtered_count = logger.appended
+
+        # Drop records that have been removed from the log
+        first_seq = logger.appended - len(logger.messages)
+        dropped = 0
+        while dropped < len(self._filtered) and self._filtered[dropped].seq < first_seq:
+            dropped += 1
+        del self._filtered[:dropped]
+        return self._filtered
 
     def render_item(self, window, item, index):
-        return item.split('\n', self._item_height)[:self._item_height]
+        lines = item.text.split('\n', self._item_height)[:self._item_height]
+        if item.level >= core.LOG_ERROR:
+            return [{'content': line, 'foreground': 'error'} for line in lines]
+        return lines
 
 
 class CompletionsBuffer(buffers.ListBuffer):
@@ -142,12 +300,314 @@ class CompletionsBuffer(buffers.ListBuffer):
         self._completions = []
 
     def set_completions(self, completions):
+        """
+        Replace the displayed completions, e.g., while completing live.
+        """
         self._completions = completions
+        self.set_variable(['win/buf', 'selected-item'], 0)
+        self.set_variable(['win/buf', 'first-row'], 0)
 
     def items(self):
         return self._completions
 
 
+FILE_INDEXED_EVENT = 'file-view-indexed'
+
+
+class FileViewBuffer(buffers.ScrollableBuffer):
+    """
+    Display a text file without reading it into memory.
+
+    The file is memory-mapped and only the lines displayed are decoded.
+    Line offsets are indexed when the file is first displayed, for files
+    larger than INDEX_THRESHOLD bytes in the background.
+
+    Use q to close the buffer again.
+    """
+
+    __keymap__ = {
+        'q': buffers.close_buffer,
+        '<up>': buffers.scroll_up,
+        '<down>': buffers.scroll_down,
+        '<pgup>': buffers.scroll_page_up,
+        '<pgdown>': buffers.scroll_page_down,
+    }
+
+    INDEX_THRESHOLD = 16 * 1024 * 1024
+    INDEX_CHUNK_SIZE = 1024 * 1024
+
+    @classmethod
+    def name(cls, file_path, **kwargs):
+        return "File: %s" % file_path
+
+    def __init__(self, file_path):
+        super(FileViewBuffer, self).__init__(file_path)
+        self._file_path = file_path
+        with open(file_path, 'rb') as f:
+            self._size = os.fstat(f.fileno()).st_size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._size else b''
+        # Start offsets of lines, indexed up to _indexed
+        self._offsets = array.array('Q', [0])
+        self._indexed = 0
+        self._indexing = False
+        # Held while indexing a chunk, so the map is not closed meanwhile
+        self._lock = threading.Lock()
+        self._killed = False
+
+    @property
+    def cwd(self):
+        return os.path.dirname(os.path.abspath(self._file_path))
+
+    def _index_chunk(self):
+        """
+        Index the lines in the next chunk of the file.
+        Returns False if the file has been indexed completely.
+        """
+        start = self._indexed
+        if start >= self._size:
+            return False
+        end = self._map.rfind(b'\n', start, start + FileViewBuffer.INDEX_CHUNK_SIZE)
+        if end == -1:
+            end = self._map.find(b'\n', start + FileViewBuffer.INDEX_CHUNK_SIZE)
+        if end == -1:
+            self._indexed = self._size
+            return False
+
+        lines = self._map[start:end].split(b'\n')
+        self._offsets.extend(itertools.islice(
+            itertools.accumulate(map((1).__add__, map(len, lines)), initial=start),
+            1, None))
+        self._indexed = end + 1
+        return True
+
+    def _index_background(self):
+        posted = time.time()
+        while True:
+            with self._lock:
+                if self._killed or not self._index_chunk():
+                    break
+            if time.time() - posted > 0.5:
+                api.post_async_event(FILE_INDEXED_EVENT)
+                posted = time.time()
+        api.post_async_event(FILE_INDEXED_EVENT)
+
+    def _start_indexing(self):
+        self._indexing = True
+        if self._size > FileViewBuffer.INDEX_THRESHOLD:
+            api.register_async_event(FILE_INDEXED_EVENT, lambda _: None)
+            threading.Thread(target=self._index_background, daemon=True).start()
+        else:
+            while self._index_chunk():
+                pass
+
+    def line_count(self):
+        if not self._indexing:
+            self._start_indexing()
+        # The last offset is the start of an incomplete line,
+        # or the end of the file, if it ends with a line break.
+        count = len(self._offsets)
+        if self._indexed < self._size or self._offsets[-1] == self._size:
+            count -= 1
+        return count
+
+    def search_count(self):
+        return self.line_count()
+
+    def search_text(self, index):
+        return self._line(index, self._size)
+
+    def get_line(self, window, index):
+        # Long lines are cut after a number of wrapped rows
+        return self._line(index, window.columns * 256)
+
+    def _line(self, index, max_length):
+        start = self._offsets[index]
+        end = self._offsets[index + 1] - 1 if index + 1 < len(self._offsets) else self._size
+        return self._map[start:min(end, start + max_length)] \
+                   .decode('utf-8', errors='replace').rstrip('\r')
+
+    def on_kill(self):
+        # The file itself has been closed after mapping it
+        with self._lock:
+            self._killed = True
+            if self._size:
+                self._map.close()
+
+    def get_lines(self, window):
+        first_row = window._state['first-row']
+        # Lines are cut after the last column displayed, which takes at
+        # most 4 bytes per column
+        max_length = (window._state['first-column'] + window.columns) * 4
+        for index in range(first_row, min(self.line_count(), first_row + window.rows)):
+            yield self._line(index, max_length)
+
+
+@buffers.with_current_buffer
+def toggle_follow(buffer_object):
+    """
+    Toggle scrolling to the end of the file, when lines are appended.
+    """
+    buffer_object.toggle_follow()
+
+
+class TailBuffer(buffers.ScrollableBuffer):
+    """
+    Follow a growing file, like tail -F.
+
+    Lines appended to the file are read as soon as inotify reports a
+    change, or every POLL_INTERVAL seconds if inotify is not available.
+    If the file is truncated, it is read again from the start. If it is
+    replaced, e.g. by log rotation, the new file is followed.
+
+    The number of lines kept can be set via variable scrollback-limit.
+    Use f to toggle following the end of the file, and q to close the
+    buffer again.
+    """
+
+    __keymap__ = {
+        'q': buffers.close_buffer,
+        'f': toggle_follow,
+        '<up>': buffers.scroll_up,
+        '<down>': buffers.scroll_down,
+        '<pgup>': buffers.scroll_page_up,
+        '<pgdown>': buffers.scroll_page_down,
+    }
+
+    POLL_INTERVAL = 1.0
+    INITIAL_BYTES = 64 * 1024
+
+    @classmethod
+    def name(cls, file_path, **kwargs):
+        return "Tail: %s" % file_path
+
+    def __init__(self, file_path):
+        super(TailBuffer, self).__init__(file_path)
+        self._file_path = os.path.abspath(file_path)
+        self._lines = RingBuffer(api.get_variable(['scrollback-limit']))
+        self._partial = b''
+        self._file = None
+        self._inode = None
+        self._follow = True
+        self._to_bottom = True
+        self._timer = None
+        self._inotify = None
+
+        self._open(initial=True)
+        if self._file:
+            self._read()
+        if inotify.available():
+            self._inotify = inotify.Inotify()
+            self._inotify.add_watch(os.path.dirname(self._file_path),
+                                    inotify.IN_MODIFY | inotify.IN_CREATE |
+                                    inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO |
+                                    inotify.IN_DELETE)
+            api.register_waitable(self._inotify, self._handle_events)
+        else:
+            self._timer = api.add_timer(TailBuffer.POLL_INTERVAL, self._poll)
+
+    @property
+    def cwd(self):
+        return os.path.dirname(self._file_path)
+
+    def on_kill(self):
+        if self._inotify:
+            api.unregister_waitable(self._inotify)
+            self._inotify.close()
+        if self._timer:
+            self._timer.cancel()
+        self._close()
+
+    def toggle_follow(self):
+        self._follow = not self._follow
+        self._to_bottom = self._follow
+        api.message('Follow mode %s.' % ('enabled' if self._follow else 'disabled'))
+
+    def _open(self, initial=False):
+        try:
+            self._file = open(self._file_path, 'rb')
+        except FileNotFoundError:
+            return
+        stat = os.fstat(self._file.fileno())
+        self._inode = stat.st_ino
+        if initial and stat.st_size > TailBuffer.INITIAL_BYTES:
+            # Only read the last lines of a large file
+            self._file.seek(stat.st_size - TailBuffer.INITIAL_BYTES)
+            self._file.readline()
+
+    def _close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._inode = None
+
+    def _read(self):
+        data = self._partial + self._file.read()
+        lines = data.split(b'\n')
+        self._partial = lines.pop()
+        if lines:
+            self._lines.extend(line.decode('utf-8', errors='replace').rstrip('\r')
+                               for line in lines)
+            self._to_bottom = self._follow
+
+    def _update(self):
+        try:
+            stat = os.stat(self._file_path)
+        except FileNotFoundError:
+            stat = None
+
+        if self._file and (stat is None or stat.st_ino != self._inode):
+            # File has been rotated or deleted, read the rest of the old file
+            self._read()
+            self._close()
+        if self._file is None and stat is not None:
+            self._partial = b''
+            self._open()
+        if self._file:
+            if os.fstat(self._file.fileno()).st_size < self._file.tell():
+                self._lines.append({'content': '--- %s truncated ---' % self._file_path,
+                                    'foreground': 'inactive'})
+                self._partial = b''
+                self._file.seek(0)
+            self._read()
+
+    def _handle_events(self, _):
+        name = os.path.basename(self._file_path)
+        if any(event_name == name for _, _, _, event_name in self._inotify.read_events()):
+            self._update()
+
+    def _poll(self):
+        self._update()
+        self._timer = api.add_timer(TailBuffer.POLL_INTERVAL, self._poll)
+
+    def on_pre_render(self):
+        self._lines.maxlen = api.get_variable(['scrollback-limit'])
+
+    def line_count(self):
+        return len(self._lines)
+
+    def dropped_lines(self):
+        return self._lines.dropped
+
+    def search_count(self):
+        return len(self._lines)
+
+    def search_text(self, index):
+        return line_text(self._lines[index])
+
+    def on_pre_render_win(self, window):
+        self.keep_position(window)
+        if window == api.selected_window() and self._to_bottom:
+            self.scroll_to_bottom(window)
+            self._to_bottom = False
+
+    def get_line(self, window, index):
+        return self._lines[index]
+
+    def get_lines(self, window):
+        first_row = window._state['first-row']
+        yield from self._lines.islice(first_row, first_row + window.rows)
+
+
 class StaticBuffer(buffers.ListBuffer):
     """
     Display content serialized as JSON
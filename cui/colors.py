@@ -21,6 +21,7 @@ the types provided by this module, which are:
 - modeline_inactive: the background color of all other modelines
 - special: This background is be used to highlight important
   sections of the screen, e.g. the current line in a debugger
+- search: the background of matches of an incremental search
 
 New foreground definitions may be added by calling defcolor*.
 
@@ -63,6 +64,8 @@ FGCOL_MAP = {
     'special':           'black',
     'divider':           'white',
 
+    'search':            'black',
+
     'error':             'red',
     'info':              'green'
 }
@@ -74,7 +77,8 @@ BGCOL_MAP = {
     'selection':         'white',
     'modeline_active':   'white',
     'modeline_inactive': 'black',
-    'special':           'white'
+    'special':           'white',
+    'search':            'yellow'
 }
 
 BGCOL_MAP_COMPAT = BGCOL_MAP.copy()
@@ -5,10 +5,12 @@
 import atexit
 import contextlib
 import functools
+import inspect
 import itertools
 import math
 import signal
 import sys
+import time
 import traceback
 
 import cui
@@ -16,11 +18,13 @@ import cui.term.curses
 
 from cui import buffers
 from cui.term import Frame
-from cui.keymap import WithKeymap
+from cui.keymap import Keymap, WithKeymap
 from cui.util import deep_get, deep_put, forward
 from cui.colors import ColorCore, ColorException
 from cui.meta import Singleton, combine_meta_classes
 from cui.io_selector import IOSelector
+from cui.util.gap_buffer import GapBuffer
+from cui.util.ring_buffer import RingBuffer
 
 __all__ = ['init_func', 'Core']
 
@@ -101,17 +105,106 @@ def update_func(fn):
 # ==============================================================================
 
 
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_ERROR = 40
+
+LOG_LEVELS = {
+    'debug':   LOG_DEBUG,
+    'info':    LOG_INFO,
+    'warning': LOG_WARNING,
+    'error':   LOG_ERROR,
+}
+
+
+class LogRecord(object):
+    """
+    A message posted to the log.
+
+    The message is formatted with ``%``-style ``args`` and a traceback
+    is rendered only when the record is displayed. If ``args`` do not
+    match the message, the representations of both are displayed.
+    """
+
+    __slots__ = ('level', 'created', 'seq', '_msg', '_args', '_exc', '_message', '_text')
+
+    def __init__(self, level, msg, args=(), exc=None):
+        self.level = level
+        self.created = time.time()
+        self.seq = None
+        self._msg = msg
+        self._args = args
+        self._exc = exc
+        self._message = None
+        self._text = None
+
+    @property
+    def message(self):
+        """
+        The formatted message. For exceptions this is the last line of
+        the traceback.
+        """
+        if self._message is None:
+            if self._msg is None:
+                self._message = list(self._exc.format_exception_only())[-1]
+            elif self._args:
+                try:
+                    self._message = self._msg % self._args
+                except Exception:
+                    # Formatting is deferred to the display of the
+                    # record, which must not fail, cf. logging
+                    self._message = '%r %% %r (formatting failed)' % (self._msg, self._args)
+            else:
+                self._message = str(self._msg)
+        return self._message
+
+    @property
+    def text(self):
+        """
+        The formatted message, including the traceback of exceptions.
+        """
+        if self._exc is None:
+            return self.message
+        if self._text is None:
+            self._text = ''.join(self._exc.format())
+        return self._text
+
+    def __str__(self):
+        return self.text
+
+
 class Logger(object):
-    def __init__(self):
-        self.messages = []
+    """
+    Keeps the most recent log records, the number of records can be
+    set via variable message-limit.
+    """
 
-    def log(self, msg):
-        if (len(self.messages) > 1000):
-            self.messages.pop(0)
-        self.messages.append(msg)
+    def __init__(self, limit=1000):
+        self.messages = RingBuffer(limit)
+        self.appended = 0
+        # Callables receiving each appended record
+        self.sinks = []
+        # Provides records dropped from messages, see cui.tools.log_file
+        self.archive = None
+
+    def set_limit(self, limit):
+        self.messages.maxlen = limit
+
+    def log(self, msg, *args, level=LOG_INFO, exc=None):
+        record = LogRecord(level, msg, args, exc)
+        self.append(record)
+        return record
+
+    def append(self, record):
+        record.seq = self.appended
+        self.appended += 1
+        self.messages.append(record)
+        for sink in self.sinks:
+            sink(record)
 
     def clear(self):
-        self.messages = []
+        self.messages.clear()
 
 
 def echo_area_default():
@@ -145,21 +238,116 @@ class MiniBuffer(buffers.InputBuffer):
     def prompt(self):
         return self._core.mini_buffer_state.get('prompt', '')
 
+    def _handle_input(self, keychords):
+        # Keys bound by the prompt take precedence
+        state = self._core.mini_buffer_state
+        keymap = state.get('keymap') if state else None
+        key_fn = keymap[keychords] if keymap else None
+        if isinstance(key_fn, dict):
+            return True
+        elif key_fn is not None:
+            return key_fn
+        return super(MiniBuffer, self)._handle_input(keychords)
+
+    def history_key(self):
+        # Prompts share the history of previous prompts with same text
+        return 'minibuffer-%s' % self.prompt.strip().rstrip(':')
+
     def on_auto_complete(self):
-        if self._core.mini_buffer_state['complete_function'] is None:
+        """
+        Invoke the completion function of the minibuffer.
+
+        The completion function may return a future (see
+        ``TreeBuffer.fetch_children``) instead of the completed content,
+        in which case the minibuffer is updated once the future is done,
+        unless its content has been edited in the meantime, which
+        cancels the future.
+        """
+        state = self._core.mini_buffer_state
+        if state['complete_function'] is None:
             return super(MiniBuffer, self).on_auto_complete()
-        return self._core.mini_buffer_state['complete_function'](self._buffer)
+
+        content = str(self._buffer)
+        result = self._complete(state, content)
+        if hasattr(result, 'add_done_callback'):
+            result = content
+        # Completions for the result are displayed already
+        state['live_query'] = result
+        return result
+
+    def _complete(self, state, content, live=False):
+        self.cancel_completion(state)
+        state['live'] = live
+        try:
+            result = state['complete_function'](content)
+        finally:
+            state['live'] = False
+        if hasattr(result, 'add_done_callback'):
+            state['completion'] = (content, result, live)
+            # Done callbacks may run on any thread
+            result.add_done_callback(functools.partial(self._core.io_selector.call_in_event_loop,
+                                                       self._completion_done, state))
+        return result
+
+    def _complete_live(self, state):
+        """
+        Invoke the completion function for live completion, which only
+        displays completions, but does not change the minibuffer.
+        """
+        state.pop('live_timer', None)
+        if state is not self._core.mini_buffer_state:
+            return
+        state['live_query'] = str(state['buffer'])
+        self._complete(state, state['live_query'], live=True)
+
+    def cancel_completion(self, state):
+        _, future, _ = state.pop('completion', (None, None, None))
+        if future is not None:
+            future.cancel()
+        timer = state.pop('live_timer', None)
+        if timer is not None:
+            timer.cancel()
+
+    def _completion_done(self, state, future):
+        content, pending, live = state.get('completion', (None, None, None))
+        if pending is not future:
+            return
+        del state['completion']
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self._core.message('Completion failed: %s', future.exception(), level=LOG_ERROR)
+        elif not live and state is self._core.mini_buffer_state and \
+             str(state['buffer']) == content:
+            state['live_query'] = future.result()
+            self.reset_buffer(future.result())
 
     def on_send_current_buffer(self, b):
         if self._core.mini_buffer_state:
             self._core.mini_buffer_state.get('submit_function', lambda _: None)(b)
 
-    def get_input_lines(self):
+    def on_buffer_changed(self):
+        state = self._core.mini_buffer_state
+        if state and state.get('completion') and \
+           state['completion'][0] != str(self._buffer):
+            self.cancel_completion(state)
+        if state and state['complete_function'] and \
+           self._core.get_variable(['live-completion']) and \
+           str(self._buffer) != state.get('live_query'):
+            self.cancel_completion(state)
+            state['live_timer'] = self._core.io_selector.add_timer(
+                self._core.get_variable(['live-completion-delay']),
+                functools.partial(self._complete_live, state))
+        if state and state.get('update_function'):
+            state['update_function'](str(self._buffer))
+
+    def get_input_lines(self, window):
         for i, s in enumerate(self._core.mini_buffer_states):
             yield self.get_buffer_line(s['prompt'],
                                        s['buffer'],
                                        s['cursor'],
-                                       show_cursor=(i == 0))
+                                       show_cursor=(i == 0),
+                                       width=window.columns)
 
     def get_echo_area(self, window):
         left, right = self._core.echo_area
@@ -171,7 +359,7 @@ class MiniBuffer(buffers.InputBuffer):
         return [left, ' ' * max(0, space), right]
 
     def get_lines(self, window):
-        yield from itertools.islice(self.get_input_lines(), window.rows - 1)
+        yield from itertools.islice(self.get_input_lines(window), window.rows - 1)
         yield self.get_echo_area(window)
 
 # Runloop Control
@@ -201,6 +389,33 @@ class RunloopState(object):
         self.current_keychord = []
         self.on_exit = []
         self.mini_buffer_state = None
+        # The command waiting for input, if this state belongs to a
+        # prompt yielded by a command (see Prompt)
+        self.coroutine = None
+
+
+class Prompt(object):
+    """
+    A request for input from the minibuffer.
+
+    Interactive commands implemented as generators yield a Prompt
+    to read a string. The command is suspended until the minibuffer
+    is submitted, which resumes the command with the string read.
+    Cancelling the minibuffer raises RunloopCancel in the command.
+    Unlike read_string, this does not enter a nested runloop, so
+    the command is resumed by the top-level runloop.
+
+    The arguments correspond to ``Core.activate_minibuffer``.
+    """
+
+    def __init__(self, prompt, default='', complete_fn=None, exit_fn=None, update_fn=None,
+                 keymap=None):
+        self.prompt = prompt
+        self.default = default
+        self.complete_fn = complete_fn
+        self.exit_fn = exit_fn
+        self.update_fn = update_fn
+        self.keymap = keymap
 
 
 def runloop_cancel():
@@ -243,13 +458,55 @@ def _interactive_context(handle_cancel):
             Core().set_interactive(False)
 
 
-def run_interactive(fn, handle_cancel=False):
+def _await(value):
+    # Resolve value, if it is a Prompt or a generator yielding prompts
+    if isinstance(value, Prompt):
+        return (yield value)
+    elif inspect.isgenerator(value):
+        return (yield from value)
+    return value
+
+
+def _interactive_coroutine(fn):
     args = getattr(fn, '__cui_interactive_args__', [])
     kwargs = getattr(fn, '__cui_interactive_kwargs__', {})
 
+    arg_values = []
+    for arg in args:
+        arg_values.append((yield from _await(arg())))
+    kwarg_values = {}
+    for kwarg in kwargs:
+        kwarg_values[kwarg] = yield from _await(kwargs[kwarg]())
+    return (yield from _await(fn(*arg_values, **kwarg_values)))
+
+
+def _with_result(coroutine, result_fn):
+    result = yield from coroutine
+    result_fn(result)
+    return result
+
+
+def run_interactive(fn, handle_cancel=False, result_fn=None):
+    """
+    Run ``fn`` with the arguments provided by its interactive decorator.
+
+    ``fn`` as well as the functions providing its arguments may return a
+    Prompt or a generator yielding prompts. In this case ``fn`` is
+    suspended until the input is read and run_interactive returns None.
+    Otherwise the result of ``fn`` is returned.
+
+    :param result_fn: If provided, called with the result of ``fn``
+                      once it has finished
+    """
     with _interactive_context(handle_cancel):
-        return fn(*[arg() for arg in args],
-                  **{kwarg: kwargs[kwarg]() for kwarg in kwargs})
+        coroutine = _interactive_coroutine(fn)
+        if result_fn:
+            coroutine = _with_result(coroutine, result_fn)
+        try:
+            prompt = next(coroutine)
+        except StopIteration as e:
+            return e.value
+        Core().enter_prompt(coroutine, prompt)
 
 
 @forward(lambda self: self._frame,
@@ -277,9 +534,14 @@ class Core(WithKeymap,
         self.buffers = []
         self._mini_buffer = MiniBuffer(self)
         self._exit_handlers = []
-        self._last_message = ""
+        self._last_message = LogRecord(LOG_INFO, '')
         self._frame = None
         self._removed_update_funcs = []
+        self._kbd_macro = None
+        self._last_kbd_macro = None
+        self._kbd_macro_replay = None
+        self._kbd_macro_steps = 0
+        self._kbd_macro_deadline = 0
         self._runloops = []
         self._running = False
         self._interactive = False
@@ -289,32 +551,45 @@ class Core(WithKeymap,
         self._state = {}
         self.def_variable(['tab-stop'], 4)
         self.def_variable(['tree-tab'], 2)
+        self.def_variable(['time-slice'], 0.02)
+        self.def_variable(['scrollback-limit'], 10000)
+        self.def_variable(['message-limit'], 1000)
+        self.def_variable(['history-limit'], 1000)
+        # Display completions while typing, not only on <tab>
+        self.def_variable(['live-completion'], False)
+        # Seconds after the last edit until completions are displayed
+        self.def_variable(['live-completion-delay'], 0.3)
+        # Maximum number of keychords dispatched by a keyboard macro
+        self.def_variable(['kbd-macro-limit'], 100000)
         self.def_variable(['echo-area'], echo_area_default)
 
         from cui.buffers_std import LogBuffer
         self.def_variable(['default-buffer-class'], LogBuffer)
 
-    def message(self, msg, show_log=True, log_message=None):
+    def message(self, msg, *args, show_log=True, log_message=None, level=LOG_INFO):
         """
         Display a message in the echo area and log it.
 
         :param msg: The message to be displayed
+        :param args: Arguments for formatting ``msg`` with ``%``, which
+                     is done only when the message is displayed
         :param show_log: Set to False, to avoid appending the message to the log
         :param log_message: Provide an alternative text for appending to the log
+        :param level: The log level of the message, e.g. LOG_ERROR
         """
-        self._last_message = msg
+        record = LogRecord(level, msg, args)
+        self._last_message = record
         if log_message:
-            self.logger.log(log_message)
+            self.logger.log(log_message, level=level)
         elif show_log:
-            self.logger.log(msg)
+            self.logger.append(record)
 
     def exception(self):
         """
         Call to log the last thrown exception exception.
         """
-        exc_type, exc_value, exc_tb = sys.exc_info()
-        cui.message(traceback.format_exception_only(exc_type, exc_value)[-1],
-                    log_message=traceback.format_exc())
+        exc = traceback.TracebackException(*sys.exc_info(), lookup_lines=False)
+        self._last_message = self.logger.log(None, level=LOG_ERROR, exc=exc)
 
     def get_buffer(self, buffer_class, *args):
         buffer_name = buffer_class.name(*args)
@@ -380,6 +655,7 @@ class Core(WithKeymap,
     def kill_buffer_object(self, buffer_object):
         self.replace_buffer(buffer_object, self._find_next_buffer(buffer_object))
         self.buffers.remove(buffer_object)
+        buffer_object.on_kill()
 
         if len(self.buffers) == 0:  # Ensure we always have a buffer available
             cui.switch_buffer(self.get_variable('default-buffer-class'))
@@ -417,7 +693,7 @@ class Core(WithKeymap,
             try:
                 self._exit_handlers.pop()()
             except:
-                self.logger.log(traceback.format_exc())
+                self.logger.log(traceback.format_exc(), level=LOG_ERROR)
 
     def _at_exit(self):
         self._run_exit_handlers()
@@ -429,16 +705,16 @@ class Core(WithKeymap,
             try:
                 fn()
             except:
-                self.message('init-function %s failed:\n%s'
-                             % (fn.__name__, traceback.format_exc()))
+                self.message('init-function %s failed:\n%s',
+                             fn.__name__, traceback.format_exc(), level=LOG_ERROR)
 
     def _post_init_packages(self):
         for fn in Core.__post_init_functions__:
             try:
                 fn()
             except:
-                self.message('post-init-function %s failed:\n%s'
-                             % (fn.__name__, traceback.format_exc()))
+                self.message('post-init-function %s failed:\n%s',
+                             fn.__name__, traceback.format_exc(), level=LOG_ERROR)
 
     def remove_update_func(self, fn):
         self._removed_update_funcs.append(fn)
@@ -456,18 +732,19 @@ class Core(WithKeymap,
             try:
                 fn()
             except:
-                self.message('update-function %s failed:\n%s'
-                             % (fn.__name__, traceback.format_exc()))
+                self.message('update-function %s failed:\n%s',
+                             fn.__name__, traceback.format_exc(), level=LOG_ERROR)
 
     def _update_ui(self):
         # Reset on_pre_render-flag on all buffers
         for buf in self.buffers:
             buf.on_pre_render_called = False
+        self.logger.set_limit(self.get_variable(['message-limit']))
         self._frame.render()
 
     @property
     def last_message(self):
-        return self._last_message
+        return self._last_message.message
 
     @property
     def echo_area(self):
@@ -485,9 +762,47 @@ class Core(WithKeymap,
     def takes_input(self):
         return self.current_buffer().takes_input
 
+    def dispatch_paste(self, text):
+        if self._kbd_macro_replay is not None:
+            return
+        if self._kbd_macro is not None:
+            self._kbd_macro.append((None, text))
+        self._dispatch_paste(text)
+
+    def _dispatch_paste(self, text):
+        """
+        Insert pasted ``text`` into the current buffer as a whole,
+        without interpreting it as keychords.
+        """
+        rl = self._runloops[0]
+        rl.current_keychord = []
+        if not self.takes_input():
+            self.message('Buffer does not accept input.', show_log=False)
+            return
+        try:
+            self.current_buffer().insert_paste(text)
+        except:
+            cui.exception()
+
     def dispatch_input(self, keychord, is_input):
+        if self._kbd_macro_replay is not None:
+            # Input is discarded while a keyboard macro is replayed
+            if keychord == 'C-g':
+                self._kbd_macro_replay = None
+                self.message('Keyboard macro interrupted.')
+            return
+        if self._kbd_macro is not None:
+            if keychord == 'C-g':
+                self._kbd_macro = None
+            else:
+                self._kbd_macro.append((keychord, is_input))
+        self._dispatch_input(keychord, is_input)
+
+    def _dispatch_input(self, keychord, is_input):
         rl = self._runloops[0]
-        if keychord == 'C-g':
+        if keychord == 'C-g' and rl.coroutine is not None:
+            self.exit_prompt(rl, exception=RunloopCancel())
+        elif keychord == 'C-g':
             runloop_cancel()
         else:
             try:
@@ -507,6 +822,7 @@ class Core(WithKeymap,
                     self.message('Unknown keychord: %s' % ' '.join(rl.current_keychord),
                                  show_log=False)
                     rl.current_keychord = []
+                    self._kbd_macro_replay = None
                 else:
                     self.message(' '.join(rl.current_keychord), show_log=False)
             except RunloopResult:
@@ -518,13 +834,90 @@ class Core(WithKeymap,
             except:
                 cui.exception()
                 rl.current_keychord = []
+                self._kbd_macro_replay = None
+
+    # Keyboard Macros
+
+    def start_kbd_macro(self):
+        """
+        Start recording keychords into a keyboard macro.
+        """
+        if self._kbd_macro is not None:
+            self.message('Already defining keyboard macro.')
+            return
+        self._kbd_macro = []
+        self.message('Defining keyboard macro...')
+
+    def end_kbd_macro(self):
+        """
+        Stop recording the keyboard macro.
+        """
+        if self._kbd_macro is None:
+            self.message('Not defining keyboard macro.')
+            return
+        self._drop_invoking_keychords()
+        self._last_kbd_macro = self._kbd_macro
+        self._kbd_macro = None
+        self.message('Keyboard macro defined.')
+
+    def _drop_invoking_keychords(self):
+        # Drop the recorded keychords invoking the current command
+        invoking = len(self._runloops[0].current_keychord)
+        del self._kbd_macro[max(0, len(self._kbd_macro) - invoking):]
+
+    def call_last_kbd_macro(self, count=1):
+        """
+        Replay the last keyboard macro ``count`` times.
+
+        The recorded keychords are dispatched by the runloop without
+        rendering in between. Only after each time slice, the screen is
+        updated and input is read, so that C-g interrupts the replay.
+        Replay stops at the first error, or after the number of keychords
+        set in variable kbd-macro-limit.
+        """
+        if self._kbd_macro is not None:
+            self._drop_invoking_keychords()
+            self.message('Can not replay a keyboard macro while defining one.')
+        elif self._kbd_macro_replay is not None:
+            # The macro invokes itself, which would never terminate
+            self._kbd_macro_replay = None
+            self.message('Keyboard macro can not replay itself.')
+        elif not self._last_kbd_macro:
+            self.message('No keyboard macro defined.')
+        else:
+            self._kbd_macro_steps = 0
+            self._kbd_macro_replay = itertools.chain.from_iterable(
+                itertools.repeat(self._last_kbd_macro, count))
+
+    def _replay_kbd_macro_event(self):
+        event = next(self._kbd_macro_replay, None)
+        if event is None:
+            self._kbd_macro_replay = None
+            return
+        self._kbd_macro_steps += 1
+        if self._kbd_macro_steps > self.get_variable(['kbd-macro-limit']):
+            self._kbd_macro_replay = None
+            self.message('Keyboard macro stopped after %s keychords.',
+                         self._kbd_macro_steps - 1)
+            return
+        keychord, data = event
+        if keychord is None:
+            self._dispatch_paste(data)
+        else:
+            self._dispatch_input(keychord, data)
 
     @property
     def minibuffer_height(self):
         return len(list(filter(lambda rl: rl.mini_buffer_state is not None,
                                self._runloops))) + 1
 
-    def activate_minibuffer(self, prompt, submit_fn, default='', complete_fn=None, exit_fn=None):
+    def activate_minibuffer(self, prompt, submit_fn, default='', complete_fn=None, exit_fn=None,
+                            update_fn=None, keymap=None):
+        """
+        Display a minibuffer reading a string, which is passed to
+        ``submit_fn``. ``keymap`` may provide a dict of keychords to
+        functions, which are bound while the minibuffer is active.
+        """
         mini_buffer_id = ('minibuffer-%s'
                           % len(list(filter(lambda rl: rl.mini_buffer_state is not None,
                                             self._runloops))))
@@ -533,15 +926,58 @@ class Core(WithKeymap,
         self._runloops[0].mini_buffer_state = {
             'id': mini_buffer_id,
             'prompt': prompt,
-            'buffer': '',
+            'buffer': GapBuffer(),
             'cursor': 0,
             'submit_function': submit_fn,
             'complete_function': _complete_fn,
+            'update_function': update_fn,
+            'keymap': Keymap(keymap) if keymap else None,
         }
+        state = self._runloops[0].mini_buffer_state
+        self._runloops[0].on_exit.append(lambda: self.mini_buffer.cancel_completion(state))
         if exit_fn:
             self._runloops[0].on_exit.append(_exit_fn)
         self.mini_buffer.reset_buffer(default)
 
+    def enter_prompt(self, coroutine, prompt):
+        """
+        Display ``prompt`` in a new minibuffer and resume ``coroutine``
+        once it has been submitted or cancelled.
+        """
+        rl = RunloopState()
+        rl.running = True
+        rl.coroutine = coroutine
+        self._runloops.insert(0, rl)
+        self.activate_minibuffer(prompt.prompt,
+                                 lambda b: self.exit_prompt(rl, value=b),
+                                 prompt.default,
+                                 prompt.complete_fn,
+                                 prompt.exit_fn,
+                                 prompt.update_fn,
+                                 prompt.keymap)
+
+    def exit_prompt(self, rl, value=None, exception=None):
+        while rl.on_exit:
+            rl.on_exit.pop(0)()
+        self._runloops.remove(rl)
+        self._resume(rl.coroutine, value, exception)
+
+    def _resume(self, coroutine, value=None, exception=None):
+        with _interactive_context(handle_cancel=True):
+            try:
+                if exception is not None:
+                    prompt = coroutine.throw(exception)
+                else:
+                    prompt = coroutine.send(value)
+            except StopIteration:
+                return
+            except RunloopControl:
+                raise
+            except:
+                self.exception()
+                return
+            self.enter_prompt(coroutine, prompt)
+
     def set_interactive(self, interactive):
         has_set = not self._interactive and interactive
         self._interactive = interactive
@@ -556,11 +992,19 @@ class Core(WithKeymap,
         result = None
         try:
             while self._runloops[0].running:
+                if self._kbd_macro_replay is not None and \
+                   time.monotonic() < self._kbd_macro_deadline:
+                    self._replay_kbd_macro_event()
+                    continue
                 self._update_ui()
-                self.io_selector.select()
+                # Do not wait for input while replaying a keyboard macro
+                self.io_selector.select(block=self._kbd_macro_replay is None)
+                self._kbd_macro_deadline = time.monotonic() + \
+                                           self.get_variable(['time-slice'])
         except RunloopResult as e:
             result = e.result
         except RunloopCancel:
+            self._kbd_macro_replay = None
             # In interactive mode top-level interactive handles cancel
             if self._interactive:
                 raise
@@ -6,12 +6,33 @@
 The IOSelector class provides an abstraction on the select syscall.
 """
 
+import collections
 import cui
+import functools
+import heapq
+import itertools
 import os
 import select
+import time
 
 # TODO remove as_update_func
 
+CALL_EVENT = 'call-in-event-loop'
+
+class Timer(object):
+    """
+    A handler scheduled via ``IOSelector.add_timer``.
+    """
+
+    def __init__(self, deadline, handler):
+        self.deadline = deadline
+        self.handler = handler
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
 class IOSelector(object):
     """
     The IOSelector class provides an abstraction on the select syscall.
@@ -34,6 +55,16 @@ class IOSelector(object):
     On each call to select, all waitables with pending input are dispatched
     to their corresponding handler.
 
+    Callables may be passed from other threads to the thread calling select
+    via call_in_event_loop. These are run on the next call to select in the
+    order they have been passed.
+
+    Handlers that should run after a delay may be scheduled by calling
+    add_timer. Timers are run after the waitables have been dispatched,
+    so a handler scheduled with a delay of 0 is executed on the next call
+    to select, after pending input has been processed. This allows to
+    split long-running operations into time slices.
+
     To customize the behaviour of IOSelector, use the parameters ``timeout``,
     which controls the timeout of the select-function and ``as_update_func``,
     which, if set, registers the IOSelector as a cui update-function.
@@ -46,12 +77,17 @@ class IOSelector(object):
         self._waitables = []
         self._handlers = {}
         self._async_handlers = {}
+        self._timers = []
+        self._timer_ids = itertools.count()
+        # Calls passed from other threads, see call_in_event_loop
+        self._calls = collections.deque()
 
         # Initialize self-pipe to handle async events
         self._pipe = os.pipe()
         self._fd_read = os.fdopen(self._pipe[0], 'r')
         self._fd_write = os.fdopen(self._pipe[1], 'w')
         self.register(self._fd_read, self._process_async_event)
+        self.register_async(CALL_EVENT, self._run_calls)
 
     def register(self, waitable, handler):
         if self._as_update_func and not cui.is_update_func(self.select):
@@ -79,11 +115,45 @@ class IOSelector(object):
         """
         self._invalidated = True
 
-    def select(self):
-        if not self._waitables:
+    def add_timer(self, delay, handler):
+        """
+        Schedule ``handler`` to be called without arguments after ``delay``
+        seconds. Returns a Timer object, that may be used to cancel the
+        call.
+        """
+        timer = Timer(time.monotonic() + delay, handler)
+        heapq.heappush(self._timers, (timer.deadline, next(self._timer_ids), timer))
+        return timer
+
+    def _select_timeout(self):
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return self._timeout
+        delay = max(0, self._timers[0][0] - time.monotonic())
+        return delay if self._timeout is None else min(delay, self._timeout)
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                timer.cancelled = True
+                try:
+                    timer.handler()
+                except:
+                    cui.exception()
+
+    def select(self, block=True):
+        """
+        Dispatch the pending waitables and timers. Unless ``block`` is
+        False, wait for input or the next timer up to the timeout.
+        """
+        if not self._waitables and not self._timers:
             return
 
-        readables, _, _ = select.select(self._waitables, [], [], self._timeout)
+        readables, _, _ = select.select(self._waitables, [], [],
+                                        self._select_timeout() if block else 0)
         for waitable in readables:
             self._invalidated = False
             self._handlers[id(waitable)](waitable)
@@ -93,6 +163,8 @@ class IOSelector(object):
             if self._invalidated:
                 break
 
+        self._run_timers()
+
     def register_async(self, name, handler):
         if '\n' in name:
             cui.message('Line-breaks not allowed in async-handler names.')
@@ -109,6 +181,21 @@ class IOSelector(object):
         self._fd_write.write('%s\n' % name)
         self._fd_write.flush()
 
+    def call_in_event_loop(self, handler, *args):
+        """
+        Schedule ``handler`` to be called with ``args`` on the thread
+        calling select. This may be called from any thread.
+        """
+        self._calls.append(functools.partial(handler, *args))
+        self.post_async_event(CALL_EVENT)
+
+    def _run_calls(self, _):
+        while self._calls:
+            try:
+                self._calls.popleft()()
+            except:
+                cui.exception()
+
     def _process_async_event(self, name):
         name = self._fd_read.readline()[:-1]
         if name in self._async_handlers:
@@ -2,7 +2,7 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-from cui.util import deep_put, deep_get, get_base_classes
+from cui.util import deep_put, get_base_classes
 
 skey_map = set(['<f1>', '<f2>', '<f3>', '<f4>', '<f5>', '<f6>', '<f7>', '<f8>',
                 '<f9>', '<f10>', '<f11>', '<f12>',
@@ -29,6 +29,21 @@ def parse_key(k):
     return k
 
 
+def _merge_keymaps(base, overlay):
+    """Merge the keymap trie ``overlay`` into a copy of ``base``.
+    Bindings of ``overlay`` take precedence, prefixes defined in both
+    tries are merged recursively.
+    """
+    merged = dict(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict):
+            current = merged.get(key)
+            merged[key] = _merge_keymaps(current if isinstance(current, dict) else {}, value)
+        elif value is not None:
+            merged[key] = value
+    return merged
+
+
 def normalize_modifiers(ms):
     unknown_modifiers = list(filter(lambda m: m not in modifiers, ms))
     if unknown_modifiers:
@@ -38,19 +53,47 @@ def normalize_modifiers(ms):
 
 
 class Keymap(object):
+    """A trie of keychords, which inherits the bindings of the keymaps
+    of ``supers``.
+
+    Lookups are served from a compiled trie, merging this keymap with
+    the compiled keymaps of its supers, so a keychord sequence is
+    resolved with one dict lookup per keychord. As keymaps are rarely
+    modified after startup, modifying any keymap invalidates all
+    compiled tries.
+    """
+
+    # Incremented on each modification of any keymap
+    _generation = 0
+
     def __init__(self, keymap, supers=[]):
         self.supers = supers
         self._keymap = {}
+        self._compiled = None
+        self._compiled_generation = -1
+        # A new keymap is compiled on first use, and no compiled
+        # trie includes it yet, so construction does not invalidate
         for key in keymap:
-            self.__setitem__(parse_keychord_string(key),
-                             keymap[key])
+            deep_put(self._keymap, parse_keychord_string(key), keymap[key])
+
+    def compiled(self):
+        if self._compiled_generation != Keymap._generation:
+            if not self._keymap and len(self.supers) == 1:
+                # Share the compiled trie, which is never modified
+                self._compiled = self.supers[0].__keymap__.compiled()
+                self._compiled_generation = Keymap._generation
+                return self._compiled
+            compiled = {}
+            for super_ in reversed(self.supers):
+                compiled = _merge_keymaps(compiled, super_.__keymap__.compiled())
+            self._compiled = _merge_keymaps(compiled, self._keymap)
+            self._compiled_generation = Keymap._generation
+        return self._compiled
 
     def flattened(self):
-        # TODO must include parent classes keymaps
         flat = {}
-        for super_ in self.supers:
-            flat.update(super_.__keymap__.flattened())
-        kstack = [{'keymap': self._keymap, 'keys': list(self._keymap.keys())}]
+        compiled = self.compiled()
+        kstack = [{'keymap': compiled, 'keys': list(compiled.keys())}]
         prefix = []
         while kstack:
             while kstack[0]['keys']:
@@ -71,16 +114,18 @@ class Keymap(object):
 
 
     def __getitem__(self, keychords):
-        fn = deep_get(self._keymap, keychords)
-        if fn is None:
-            for super_ in self.supers:
-                fn = super_.__keymap__[keychords]
-                if fn:
-                    break
-        return fn
+        node = self.compiled()
+        for keychord in keychords:
+            if not isinstance(node, dict):
+                return None
+            node = node.get(keychord)
+            if node is None:
+                return None
+        return node
 
     def __setitem__(self, keychords, fn):
         deep_put(self._keymap, keychords, fn)
+        Keymap._generation += 1
 
 
 class WithKeymapMeta(type):
@@ -110,20 +155,26 @@ class WithKeymap(object, metaclass=WithKeymapMeta):
 
     def __init__(self):
         super(WithKeymap, self).__init__()
-        self._keymap = Keymap({}, [self.__class__])
+        # Created on the first call of set_instance_keychord
+        self._keymap = None
 
     def set_instance_keychord(self, keychords, fn):
+        if self._keymap is None:
+            self._keymap = Keymap({}, [self.__class__])
         self._keymap[parse_keychord_string(keychords)] = fn
         return fn
 
     def get_instance_keychord(self, keychords):
-        return self._keymap[parse_keychord_string(keychords)]
+        return self._get_keymap()[parse_keychord_string(keychords)]
+
+    def _get_keymap(self):
+        return self.__class__.__keymap__ if self._keymap is None else self._keymap
 
     def input_delegate(self):
         return None
 
     def _handle_input(self, keychords):
-        key_fn = self._keymap[keychords]
+        key_fn = self._get_keymap()[keychords]
         if key_fn is None:
             # keychord prefix is undefined in this keymap
             return False
@@ -41,6 +41,7 @@ BG_INDEX_MAP = {
     'modeline_active':   2,
     'modeline_inactive': 3,
     'special':           4,
+    'search':            5,
 }
 
 ATTR_MAP = {
@@ -123,6 +124,7 @@ class Frame(term.Frame):
         curses.curs_set(0)
         self._screen.keypad(1)
         self._screen.timeout(0)
+        self._set_paste_mode(True)
         self._core.add_exit_handler(self.close)
 
         # Init Colors
@@ -151,6 +153,7 @@ class Frame(term.Frame):
             signal.signal(signal.SIGWINCH, self._old_signal_handler)
         self._core.io_selector.unregister_async(TERMINAL_RESIZE_EVENT)
         self._core.io_selector.unregister(sys.stdin)
+        self._set_paste_mode(False)
         curses.resetty()
         curses.endwin()
 
@@ -160,10 +163,17 @@ class Frame(term.Frame):
 
     # ------------ Terminal: Input & Resizing --------------
 
+    def _set_paste_mode(self, enabled):
+        sys.stdout.write(curses_keyreader.PASTE_MODE_ON if enabled else
+                         curses_keyreader.PASTE_MODE_OFF)
+        sys.stdout.flush()
+
     def _read_input(self, _):
         keychord, is_input = curses_keyreader.read_keychord(self._screen,
                                                             receive_input=self._core.takes_input())
-        if keychord is not None and keychord != curses_keyreader.EVT_RESIZE:
+        if keychord == curses_keyreader.EVT_PASTE:
+            self._core.dispatch_paste(is_input)
+        elif keychord is not None and keychord != curses_keyreader.EVT_RESIZE:
             self._core.dispatch_input(keychord, is_input)
 
     def _handle_resize_sig(self, _, __):
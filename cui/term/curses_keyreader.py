@@ -6,6 +6,17 @@ import curses
 import re
 
 EVT_RESIZE = 'key_resize'
+EVT_PASTE = 'paste'
+
+# Bracketed paste: terminal control sequences to switch the mode and
+# the sequences the terminal sends around pasted text
+PASTE_MODE_ON = '\x1b[?2004h'
+PASTE_MODE_OFF = '\x1b[?2004l'
+PASTE_START = [ord(c) for c in '[200~']
+PASTE_END = [ord(c) for c in '\x1b[201~']
+
+# Time in ms to wait for the remainder of a paste
+PASTE_TIMEOUT = 100
 
 KEYCHORD_MAP = {
     'C-m':        '<enter>',
@@ -104,13 +115,59 @@ def translate_keychord(keyname, meta=False):
     return KEYCHORD_MAP.get(mkeys, mkeys)
 
 
+def _read_sequence(screen, sequence):
+    """
+    Read characters from ``screen`` as long as they match ``sequence``.
+    Returns True if the whole sequence was read, otherwise all read
+    characters are pushed back into the input queue.
+    """
+    read = []
+    for expected in sequence:
+        key = screen.getch()
+        if key != -1:
+            read.append(key)
+        if key != expected:
+            for k in reversed(read):
+                curses.ungetch(k)
+            return False
+    return True
+
+
+def _read_paste(screen):
+    """
+    Read pasted text up to the paste end sequence. If the end sequence
+    does not arrive within PASTE_TIMEOUT, the text read so far is returned.
+    """
+    data = bytearray()
+    end_length = len(PASTE_END)
+    screen.timeout(PASTE_TIMEOUT)
+    while data[-end_length:] != bytes(PASTE_END):
+        key = screen.getch()
+        if key == -1:
+            break
+        if key < 256:
+            data.append(key)
+        elif key == curses.KEY_ENTER:
+            data.append(ord('\n'))
+    else:
+        del data[-end_length:]
+    text = data.decode('utf-8', errors='replace')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
 def read_keychord(screen, timeout=0, receive_input=False):
+    """
+    Read a keychord from ``screen``. Returns a tuple ``(keychord, is_input)``,
+    or ``(EVT_PASTE, text)`` if the terminal sent text in bracketed paste mode.
+    """
     key = screen.getch()
     if key == -1:
         return None, None
     if key == 27:
         try:
             screen.timeout(0)
+            if _read_sequence(screen, PASTE_START):
+                return EVT_PASTE, _read_paste(screen)
             key = screen.getch()
             if key == -1:
                 return '<esc>', False
@@ -0,0 +1,228 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides persisting the log of cui to disk.
+
+Log records are written as JSON lines to a file in the user directory
+by a background thread, which collects records in batches, so logging
+never waits for the disk. When the file exceeds its size limit it is
+rotated, keeping a number of backups (``cui.log.1``, ``cui.log.2``, ...).
+
+Once a log file is enabled, the log buffer pages records that have been
+dropped from the in-memory log back in from disk, when scrolling past
+its first record.
+
+To enable the log file, add to your init file:
+
+.. code-block:: python
+
+   import cui
+
+   cui.enable_log_file()
+
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+import cui
+
+from cui import core
+
+LOG_FILE_ERROR_EVENT = 'log-file-error'
+
+
+def _lines_before(path, offset, block_size=8192):
+    """
+    Yield ``(start, line)`` for the lines in file ``path`` which end
+    before ``offset``, starting with the last line.
+    """
+    with open(path, 'rb') as f:
+        if offset is None:
+            offset = f.seek(0, os.SEEK_END)
+        remainder = b''
+        while offset > 0:
+            size = min(block_size, offset)
+            offset -= size
+            f.seek(offset)
+            chunk = f.read(size) + remainder
+            lines = chunk.split(b'\n')
+            remainder = lines.pop(0)
+            end = offset + len(chunk)
+            for line in reversed(lines):
+                start = end - len(line)
+                if line:
+                    yield start, line
+                end = start - 1
+        if remainder:
+            yield 0, remainder
+
+
+class LogFile(object):
+    """
+    A sink for ``Logger``, writing records to ``path``.
+
+    :param path: The path of the log file
+    :param max_size: The size in bytes after which the file is rotated
+    :param backup_count: The number of rotated files to keep
+    """
+
+    BATCH_SIZE = 256
+
+    def __init__(self, path, max_size=1024 * 1024, backup_count=3):
+        self.path = path
+        self.max_size = max_size
+        self.backup_count = backup_count
+        self.session = '%x-%x' % (int(time.time()), os.getpid())
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._rotations = 0
+        self._error = None
+        self._thread = None
+
+    def __call__(self, record):
+        self._queue.put(record)
+
+    def start(self):
+        cui.register_async_event(LOG_FILE_ERROR_EVENT, self._report_error)
+        self._thread = threading.Thread(target=self._run, name='cui-log-file', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write all pending records and stop the writer thread.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _file_path(self, index):
+        return self.path if index == 0 else '%s.%s' % (self.path, index)
+
+    def _report_error(self, _):
+        cui.message('Could not write log file %s: %s', self.path, self._error,
+                    level=core.LOG_ERROR)
+
+    # ------------ Writer Thread ------------
+
+    def _run(self):
+        log_file = None
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < LogFile.BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            running = None not in batch
+
+            try:
+                if log_file is None:
+                    log_file = open(self.path, 'a', encoding='utf-8')
+                log_file.write(''.join(self._format_record(record)
+                                       for record in batch if record is not None))
+                log_file.flush()
+                if log_file.tell() >= self.max_size:
+                    log_file.close()
+                    log_file = None
+                    self._rotate()
+            except OSError as e:
+                if self._error is None:
+                    self._error = e
+                    cui.post_async_event(LOG_FILE_ERROR_EVENT)
+
+        if log_file is not None:
+            log_file.close()
+
+    def _format_record(self, record):
+        return json.dumps({
+            'session': self.session,
+            'seq':     record.seq,
+            'level':   record.level,
+            'created': record.created,
+            'text':    record.text
+        }) + '\n'
+
+    def _rotate(self):
+        with self._lock:
+            for index in range(self.backup_count, 0, -1):
+                source = self._file_path(index - 1)
+                if os.path.exists(source):
+                    os.replace(source, self._file_path(index))
+            self._rotations += 1
+
+    # ------------ Reading ------------
+
+    def records_before(self, position, count, first_seq=None):
+        """
+        Read up to ``count`` records from disk, which were written before
+        ``position``, and return them oldest first, together with the
+        position of the first record returned.
+
+        If ``position`` is None, reading starts at the end of the log
+        skipping records of this session with a ``seq`` of ``first_seq``
+        or greater, which are still held in memory.
+        """
+        with self._lock:
+            if position is None:
+                index, offset = 0, None
+            else:
+                rotations, index, offset = position
+                index += self._rotations - rotations
+
+            records = []
+            while len(records) < count and index <= self.backup_count:
+                path = self._file_path(index)
+                if os.path.exists(path):
+                    for start, line in _lines_before(path, offset):
+                        offset = start
+                        try:
+                            data = json.loads(line.decode('utf-8'))
+                        except ValueError:
+                            continue
+                        if first_seq is not None and data['session'] == self.session \
+                           and data['seq'] >= first_seq:
+                            continue
+                        records.append(self._create_record(data))
+                        if len(records) == count:
+                            break
+                    else:
+                        index, offset = index + 1, None
+                else:
+                    index, offset = index + 1, None
+
+            records.reverse()
+            return records, (self._rotations, index, offset)
+
+    def _create_record(self, data):
+        record = core.LogRecord(data['level'], data['text'])
+        record.created = data['created']
+        if data['session'] == self.session:
+            record.seq = data['seq']
+        return record
+
+
+def enable(file_name='cui.log', max_size=1024 * 1024, backup_count=3):
+    """
+    Write the log to ``file_name`` in the user directory.
+    """
+    user_dir = cui.user_directory()
+    if not os.path.exists(user_dir):
+        os.makedirs(user_dir)
+
+    log_file = LogFile(cui.user_directory(file_name), max_size, backup_count)
+    log_file.start()
+    logger = core.Core().logger
+    for record in logger.messages:
+        log_file(record)
+    logger.sinks.append(log_file)
+    logger.archive = log_file
+    cui.add_exit_handler(log_file.stop)
+    return log_file
@@ -93,6 +93,107 @@ def minmax(minimum, value, maximum):
     return max(minimum, min(value, maximum))
 
 
+def line_text(line):
+    """
+    Returns the plain text of a line, as yielded by a buffer's
+    ``get_lines``. Symbols are represented by a space.
+    """
+    if isinstance(line, str):
+        return line
+    elif isinstance(line, int):
+        return chr(line)
+    elif isinstance(line, list):
+        return ''.join(map(line_text, line))
+    elif isinstance(line, dict):
+        return line_text(line['content'])
+    return ' '
+
+
+def highlight_spans(line, spans, style):
+    """
+    Returns a copy of ``line`` in which the text covered by ``spans``,
+    a list of ``(start, end)`` columns of ``line_text(line)``, is
+    wrapped into dicts updated with ``style``.
+    """
+    return _highlight_spans(line, spans, style, 0)[0]
+
+
+def _highlight_spans(line, spans, style, col):
+    if isinstance(line, str):
+        end_col = col + len(line)
+        parts = []
+        pos = 0
+        for start, end in spans:
+            if end <= col or start >= end_col:
+                continue
+            s, e = max(start, col) - col, min(end, end_col) - col
+            if s > pos:
+                parts.append(line[pos:s])
+            parts.append(dict(style, content=line[s:e]))
+            pos = e
+        if not parts:
+            return line, end_col
+        if pos < len(line):
+            parts.append(line[pos:])
+        return parts, end_col
+    elif isinstance(line, list):
+        parts = []
+        for sub_line in line:
+            sub_line, col = _highlight_spans(sub_line, spans, style, col)
+            parts.append(sub_line)
+        return parts, col
+    elif isinstance(line, dict):
+        content, col = _highlight_spans(line['content'], spans, style, col)
+        return dict(line, content=content), col
+    if any(start <= col < end for start, end in spans):
+        return dict(style, content=line), col + 1
+    return line, col + 1
+
+
+def wrap_points(text, width, tab_width):
+    """
+    Returns the offsets in ``text`` at which rows start, if ``text``
+    is wrapped at ``width`` columns. The first row is not included.
+    """
+    if '\t' not in text:
+        return list(range(width, len(text), width))
+
+    points = []
+    col = 0
+    for index, char in enumerate(text):
+        char_width = tab_width if char == '\t' else 1
+        if col + char_width > width and col > 0:
+            points.append(index)
+            col = 0
+        col += char_width
+    return points
+
+
+def slice_line(line, start, end=None):
+    """
+    Returns the part of ``line`` displaying the characters from ``start``
+    to ``end`` of ``line_text(line)``. Styles are preserved.
+    """
+    return _slice_line(line, start, end, 0)[0]
+
+
+def _slice_line(line, start, end, col):
+    if isinstance(line, str):
+        end_col = col + len(line)
+        return line[max(0, start - col):None if end is None else max(0, end - col)], end_col
+    elif isinstance(line, list):
+        parts = []
+        for sub_line in line:
+            part, col = _slice_line(sub_line, start, end, col)
+            if part != '':
+                parts.append(part)
+        return parts, col
+    elif isinstance(line, dict):
+        content, col = _slice_line(line['content'], start, end, col)
+        return dict(line, content=content), col
+    return (line if start <= col and (end is None or col < end) else ''), col + 1
+
+
 def _deep_error(path):
     raise KeyError('Path %s does not exist.' % path)
 
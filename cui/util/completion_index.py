@@ -0,0 +1,158 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides an index for prefix and fuzzy completion.
+"""
+
+import bisect
+import heapq
+import os
+import re
+
+# Sorts after any character that may follow a prefix
+_MAX_CHAR = chr(0x10ffff)
+
+SCORE_MATCH       = 16
+SCORE_GAP_START   = -3
+SCORE_GAP_EXTEND  = -1
+BONUS_BOUNDARY    = 8
+BONUS_CAMEL_CASE  = 7
+BONUS_CONSECUTIVE = 4
+BONUS_FIRST_CHAR  = 8
+
+_BOUNDARY_CHARS = ' _-./:\\'
+
+
+def _char_bonus(candidate, index):
+    if index == 0:
+        return BONUS_BOUNDARY
+    previous, char = candidate[index - 1], candidate[index]
+    if previous in _BOUNDARY_CHARS:
+        return BONUS_BOUNDARY
+    if previous.islower() and char.isupper():
+        return BONUS_CAMEL_CASE
+    return 0
+
+
+def fuzzy_match(query, candidate, ignore_case=True):
+    """
+    Match the characters of ``query`` as a subsequence of ``candidate``
+    and return a tuple of a score and the list of matched indices, or
+    None if ``candidate`` does not match.
+
+    Similar to fzf, the shortest window of ``candidate`` containing
+    the subsequence is matched. Matches at word boundaries and runs of
+    consecutive characters score higher, while gaps reduce the score.
+    """
+    text = candidate.lower() if ignore_case else candidate
+    if not query:
+        return 0, []
+
+    # Find the first window ending with the subsequence, then
+    # shrink it from the end backwards.
+    index = -1
+    for char in query:
+        index = text.find(char, index + 1)
+        if index == -1:
+            return None
+    for char in reversed(query):
+        index = text.rindex(char, 0, index + 1) - 1
+    start = index + 1
+
+    positions = []
+    score = 0
+    index = start
+    previous = None
+    for char in query:
+        index = text.index(char, index)
+        score += SCORE_MATCH + _char_bonus(candidate, index)
+        if previous is not None:
+            if index == previous + 1:
+                score += BONUS_CONSECUTIVE
+            else:
+                score += SCORE_GAP_START + SCORE_GAP_EXTEND * (index - previous - 2)
+        positions.append(index)
+        previous = index
+        index += 1
+    if start == 0:
+        score += BONUS_FIRST_CHAR
+    return score, positions
+
+
+def _fuzzy_pattern(query, ignore_case):
+    return re.compile('.*?'.join(map(re.escape, query)),
+                      re.IGNORECASE if ignore_case else 0)
+
+
+class CompletionIndex(object):
+    """
+    A sorted list of candidates for completion.
+
+    All candidates starting with a prefix are a contiguous range of the
+    sorted list, which is found by bisection in O(log n). The common
+    prefix of all candidates in the range is the common prefix of its
+    first and last candidate.
+    """
+
+    def __init__(self, candidates):
+        self._candidates = sorted(set(candidates))
+        self._fuzzy_query = None
+        self._fuzzy_candidates = None
+
+    def __len__(self):
+        return len(self._candidates)
+
+    def __contains__(self, candidate):
+        index = bisect.bisect_left(self._candidates, candidate)
+        return index < len(self._candidates) and self._candidates[index] == candidate
+
+    def _range(self, prefix):
+        return (bisect.bisect_left(self._candidates, prefix),
+                bisect.bisect_right(self._candidates, prefix + _MAX_CHAR))
+
+    def matches(self, prefix):
+        """
+        Returns the sorted list of candidates starting with ``prefix``.
+        """
+        start, end = self._range(prefix)
+        return self._candidates[start:end]
+
+    def complete(self, prefix):
+        """
+        Returns a tuple of the longest common prefix of the candidates
+        starting with ``prefix`` and the list of these candidates.
+        """
+        start, end = self._range(prefix)
+        if start == end:
+            return prefix, []
+        return (os.path.commonprefix([self._candidates[start], self._candidates[end - 1]]),
+                self._candidates[start:end])
+
+    def fuzzy_complete(self, query, limit=100):
+        """
+        Returns the ``limit`` best fuzzy matches of ``query`` as a list of
+        tuples ``(candidate, positions)``, best match first. ``query`` is
+        matched ignoring case if it contains no upper case characters.
+
+        The candidates matching a query are kept, so if the next query
+        extends it, only these need to be matched again.
+        """
+        if self._fuzzy_query is not None and query.startswith(self._fuzzy_query):
+            candidates = self._fuzzy_candidates
+        else:
+            candidates = self._candidates
+
+        ignore_case = query.lower() == query
+        pattern = _fuzzy_pattern(query, ignore_case)
+        candidates = [candidate for candidate in candidates if pattern.search(candidate)]
+        self._fuzzy_query = query
+        self._fuzzy_candidates = candidates
+
+        query = query.lower() if ignore_case else query
+        best = heapq.nlargest(limit,
+                              ((fuzzy_match(query, candidate, ignore_case), candidate)
+                               for candidate in candidates),
+                              key=lambda match: (match[0][0], -len(match[1])))
+        return [(candidate, match[1]) for match, candidate in best]
@@ -0,0 +1,82 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides requests to asynchronous completion providers.
+"""
+
+import threading
+
+
+class CompletionRequest(object):
+    """
+    A request for the candidates completing ``query``.
+
+    Providers may add candidates from any thread via ``add`` and must
+    call ``finish`` once all candidates have been added. Long-running
+    providers should check ``cancelled`` and stop once it is set, which
+    happens when the query has become stale.
+
+    :param query: The content of the minibuffer to be completed
+    :param on_update: Called without arguments, from the thread adding
+                      candidates or finishing the request
+    """
+
+    def __init__(self, query, on_update):
+        self.query = query
+        self.cancelled = False
+        self.done = False
+        self.exception = None
+        self._candidates = []
+        self._lock = threading.Lock()
+        self._on_update = on_update
+        self._future = None
+
+    def candidates(self):
+        with self._lock:
+            return list(self._candidates)
+
+    def add(self, candidates):
+        with self._lock:
+            if self.done or self.cancelled:
+                return
+            self._candidates.extend(candidates)
+        self._on_update()
+
+    def finish(self, exception=None):
+        with self._lock:
+            if self.done or self.cancelled:
+                return
+            self.done = True
+            self.exception = exception
+        self._on_update()
+
+    def cancel(self):
+        """
+        Cancel the request, and the future passed to ``finish_with``.
+        """
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self._future is not None:
+            self._future.cancel()
+
+    def finish_with(self, future):
+        """
+        Finish the request once ``future`` is done, adding the
+        iterable of candidates it results in. Cancelling the request
+        cancels ``future``.
+        """
+        self._future = future
+        if self.cancelled:
+            future.cancel()
+        def _done(_):
+            if future.cancelled():
+                self.cancel()
+            elif future.exception() is not None:
+                self.finish(future.exception())
+            else:
+                self.add(future.result())
+                self.finish()
+        future.add_done_callback(_done)
@@ -0,0 +1,117 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides a cache of directory listings for file completion.
+"""
+
+import os
+import queue
+import threading
+import time
+
+from cui.util.completion_index import CompletionIndex
+
+# Listings of directories modified less than this many seconds before
+# they were scanned are not trusted, as file systems with a coarse
+# mtime resolution may not register later changes within that time.
+_RACY_INTERVAL = 2.0
+
+
+class DirectoryListing(object):
+    """
+    The entries of a directory as scanned by ``os.scandir``.
+
+    ``names`` is a CompletionIndex of the entries, ``directories`` the
+    set of names referring to directories.
+    """
+
+    def __init__(self, path):
+        names = []
+        directories = set()
+        scanned_at = time.time()
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        with os.scandir(path) as entries:
+            for entry in entries:
+                names.append(entry.name)
+                try:
+                    if entry.is_dir():
+                        directories.add(entry.name)
+                except OSError:
+                    pass
+        self.names = CompletionIndex(names)
+        self.directories = directories
+        self.racy = scanned_at - self.mtime_ns / 1e9 < _RACY_INTERVAL
+
+
+class DirectoryCache(object):
+    """
+    Caches listings of directories, which are validated with a single
+    ``stat`` of the directory, comparing its modification time.
+
+    Directories can be prefetched by a background thread, which is
+    started on the first call of ``prefetch``.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._listings = {}
+        self._lock = threading.Lock()
+        self._queue = None
+
+    def listing(self, path):
+        """
+        Returns the DirectoryListing of ``path`` or None, if ``path``
+        can not be listed.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            listing = self._listings.get(path)
+        try:
+            if listing is not None and not listing.racy and \
+               os.stat(path).st_mtime_ns == listing.mtime_ns:
+                return listing
+            listing = DirectoryListing(path)
+        except OSError:
+            self.invalidate(path)
+            return None
+
+        with self._lock:
+            if len(self._listings) >= self.max_entries:
+                self._listings.pop(next(iter(self._listings)))
+            self._listings[path] = listing
+        return listing
+
+    def invalidate(self, path):
+        with self._lock:
+            self._listings.pop(os.path.abspath(path), None)
+
+    def exists(self, path):
+        """
+        Returns True if ``path`` exists, looking it up in the listing
+        of its parent directory. If the parent can not be listed, e.g.,
+        as it is not readable, ``path`` is checked via ``os.path.exists``.
+        """
+        dirname, basename = os.path.split(os.path.abspath(path))
+        if not basename:
+            return os.path.isdir(dirname)
+        listing = self.listing(dirname)
+        if listing is None:
+            return os.path.exists(path)
+        return basename in listing.names
+
+    def prefetch(self, paths):
+        """
+        Scan ``paths`` in the background, so that listing them later is
+        served from the cache.
+        """
+        if self._queue is None:
+            self._queue = queue.Queue()
+            threading.Thread(target=self._run, name='cui-dir-cache', daemon=True).start()
+        for path in paths:
+            self._queue.put(path)
+
+    def _run(self):
+        while True:
+            self.listing(self._queue.get())
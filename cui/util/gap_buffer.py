@@ -0,0 +1,100 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides the text storage used by editable buffers.
+"""
+
+
+class GapBuffer(object):
+    """
+    A string that can be edited efficiently at a movable position, the gap.
+
+    The characters before the gap and the characters after the gap are
+    kept in two lists, the latter in reverse order. Inserting or deleting
+    characters at the gap, and moving the gap by a single character is
+    O(1) amortized, moving the gap by n characters is O(n).
+
+    Besides the editing operations, GapBuffer supports ``len``, ``str``,
+    indexing and slicing (without step), so it may be used in place of a
+    string when rendering.
+    """
+
+    def __init__(self, text=''):
+        self.reset(text)
+
+    def reset(self, text=''):
+        """
+        Replace the content with ``text``, and place the gap at its end.
+        """
+        self._before = list(text)
+        self._after = []
+
+    def __len__(self):
+        return len(self._before) + len(self._after)
+
+    def __str__(self):
+        return ''.join(self._before) + ''.join(reversed(self._after))
+
+    def __repr__(self):
+        return 'GapBuffer(%r)' % str(self)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError('GapBuffer does not support slicing with step.')
+            start, stop, _ = index.indices(len(self))
+            return self.text(start, stop)
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('GapBuffer index out of range')
+        if index < len(self._before):
+            return self._before[index]
+        return self._after[len(self) - index - 1]
+
+    def text(self, start=0, end=None):
+        """
+        Returns the text between ``start`` and ``end``, which is O(end - start).
+        """
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return ''
+
+        gap = len(self._before)
+        after_length = len(self._after)
+        before_part = ''.join(self._before[start:min(end, gap)]) if start < gap else ''
+        after_part = ''.join(reversed(self._after[after_length - (end - gap):
+                                                  after_length - max(0, start - gap)])) \
+                     if end > gap else ''
+        return before_part + after_part
+
+    def _move_gap(self, position):
+        gap = len(self._before)
+        if position < gap:
+            moved = self._before[position:]
+            del self._before[position:]
+            moved.reverse()
+            self._after.extend(moved)
+        elif position > gap:
+            count = position - gap
+            moved = self._after[-count:]
+            del self._after[-count:]
+            moved.reverse()
+            self._before.extend(moved)
+
+    def insert(self, position, string):
+        """
+        Insert ``string`` at ``position``.
+        """
+        self._move_gap(position)
+        self._before.extend(string)
+
+    def delete(self, position, length):
+        """
+        Delete up to ``length`` characters following ``position``.
+        """
+        self._move_gap(position)
+        del self._after[max(0, len(self._after) - length):]
@@ -0,0 +1,163 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides input histories, which may be persisted to a file.
+"""
+
+import json
+import os
+
+
+class History(object):
+    """
+    A list of at most ``limit`` distinct entries, oldest first.
+
+    Entries are kept as keys of a dict, so adding an entry that is
+    already in the history moves it to the end in O(1). If ``path``
+    is provided, the history is loaded from and appended to this file,
+    which is rewritten once it holds more than twice ``limit`` lines.
+    """
+
+    def __init__(self, limit=1000, path=None):
+        self.limit = max(1, limit)
+        self.path = path
+        self.error = None
+        self._persistent = bool(path)
+        # Incremented each time entries are added
+        self.version = 0
+        self._entries = {}
+        self._list = None
+        self._file_lines = 0
+        if path:
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if self._list is None:
+            self._list = list(self._entries)
+        return self._list[index]
+
+    def _add(self, entry):
+        self._entries.pop(entry, None)
+        self._entries[entry] = None
+        while len(self._entries) > self.limit:
+            del self._entries[next(iter(self._entries))]
+        self._list = None
+        self.version += 1
+
+    def append(self, entry):
+        self._add(entry)
+        if self._persistent:
+            self._write([entry], 'a')
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    self._file_lines += 1
+                    try:
+                        self._add(json.loads(line))
+                    except ValueError:
+                        pass
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self._failed(e)
+
+    def _write(self, entries, mode):
+        try:
+            if self._file_lines + len(entries) > 2 * self.limit:
+                entries, mode = list(self._entries), 'w'
+            if mode == 'w':
+                self._file_lines = 0
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            path = self.path + '.tmp' if mode == 'w' else self.path
+            with open(path, mode, encoding='utf-8') as f:
+                f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+            if mode == 'w':
+                os.replace(path, self.path)
+            self._file_lines += len(entries)
+        except OSError as e:
+            self._failed(e)
+
+    def _failed(self, error):
+        # Keep the history in memory only
+        self.error = error
+        self._persistent = False
+
+    def search_backward(self, query, start):
+        """
+        Returns the index of the newest entry at or before ``start``
+        that contains ``query``, or None.
+        """
+        for index in range(min(start, len(self) - 1), -1, -1):
+            if query in self[index]:
+                return index
+        return None
+
+
+class HistorySearch(object):
+    """
+    The state of a reverse incremental search in ``history``.
+
+    For each extension of the query the index of its match is kept on
+    a stack. No entry newer than the match of a query contains it, so
+    neither contains an extension of the query, and extending the query
+    continues searching at the current match. Shortening the query pops
+    the matches of the longer queries. The stack is dropped when entries
+    are added to the history.
+    """
+
+    def __init__(self, history):
+        self._history = history
+        self._stack = []
+        self._version = history.version
+
+    @property
+    def history(self):
+        return self._history
+
+    @property
+    def query(self):
+        return self._stack[-1][0] if self._stack else ''
+
+    @property
+    def match(self):
+        """
+        The index of the current match or None.
+        """
+        return self._stack[-1][1] if self._stack else None
+
+    def set_query(self, query):
+        if self._version != self._history.version:
+            self._stack = []
+            self._version = self._history.version
+        while self._stack and not query.startswith(self._stack[-1][0]):
+            self._stack.pop()
+        if self._stack and self._stack[-1][0] == query:
+            return self.match
+        if not query:
+            return None
+
+        if self._stack:
+            start = self.match
+        else:
+            start = len(self._history) - 1
+        index = None if start is None else self._history.search_backward(query, start)
+        self._stack.append((query, index))
+        return index
+
+    def next_match(self):
+        """
+        Find the next older match of the current query.
+        """
+        if self.match is None or self.match == 0:
+            return self.match
+        index = self._history.search_backward(self.query, self.match - 1)
+        if index is not None:
+            self._stack[-1] = (self.query, index)
+        return self.match
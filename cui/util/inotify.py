@@ -0,0 +1,103 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides a minimal binding to the inotify API of Linux.
+
+An Inotify object may be registered with the cui event-loop via
+``cui.register_waitable``, as it provides ``fileno``. Use ``available``
+to check if inotify is supported on the current system.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_IGNORED     = 0x00008000
+
+IN_NONBLOCK    = 0o00004000
+IN_CLOEXEC     = 0o02000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None and sys.platform.startswith('linux'):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+        except (OSError, AttributeError):
+            return None
+        _libc = libc
+    return _libc
+
+
+def available():
+    return _load_libc() is not None
+
+
+def _check(result):
+    if result == -1:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return result
+
+
+class Inotify(object):
+    """
+    An inotify instance. Events are read via ``read_events``, which
+    returns a list of tuples ``(wd, mask, cookie, name)``.
+    """
+
+    def __init__(self):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError('inotify is not available on this system.')
+        self._libc = libc
+        self._fd = _check(libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask):
+        return _check(self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask))
+
+    def rm_watch(self, wd):
+        _check(self._libc.inotify_rm_watch(self._fd, wd))
+
+    def read_events(self):
+        try:
+            buf = os.read(self._fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,94 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+This module provides a bounded sequence for scrollback and logs.
+"""
+
+
+class RingBuffer(object):
+    """
+    A sequence holding at most ``maxlen`` items.
+
+    Appending is O(1). When the buffer is full, appending an item
+    discards the oldest one. Items are addressed from the oldest (index 0)
+    to the newest (index -1). ``dropped`` counts the items discarded so
+    far, which allows views to keep their position.
+    """
+
+    def __init__(self, maxlen, iterable=()):
+        self._items = []
+        self._start = 0
+        self._maxlen = max(1, maxlen)
+        self.dropped = 0
+        self.extend(iterable)
+
+    @property
+    def maxlen(self):
+        """
+        The maximum length. Decreasing it discards the oldest items if
+        the buffer holds more than ``maxlen`` items.
+        """
+        return self._maxlen
+
+    @maxlen.setter
+    def maxlen(self, maxlen):
+        maxlen = max(1, maxlen)
+        if maxlen != self._maxlen:
+            items = list(self.islice(max(0, len(self) - maxlen)))
+            self.dropped += len(self) - len(items)
+            self._items = items
+            self._start = 0
+            self._maxlen = maxlen
+
+    def __len__(self):
+        return len(self._items)
+
+    def _index(self, index):
+        length = len(self._items)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError('RingBuffer index out of range')
+        return (self._start + index) % length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError('RingBuffer does not support slicing with step.')
+            return list(self.islice(*index.indices(len(self))[:2]))
+        return self._items[self._index(index)]
+
+    def __setitem__(self, index, value):
+        self._items[self._index(index)] = value
+
+    def __iter__(self):
+        return self.islice(0)
+
+    def islice(self, start, stop=None):
+        """
+        Iterate over the items from ``start`` up to ``stop``,
+        without copying the buffer.
+        """
+        length = len(self._items)
+        stop = length if stop is None else min(stop, length)
+        for index in range(max(0, start), stop):
+            yield self._items[(self._start + index) % length]
+
+    def append(self, item):
+        if len(self._items) < self._maxlen:
+            self._items.append(item)
+        else:
+            self._items[self._start] = item
+            self._start = (self._start + 1) % self._maxlen
+            self.dropped += 1
+
+    def extend(self, iterable):
+        for item in iterable:
+            self.append(item)
+
+    def clear(self):
+        self.dropped += len(self._items)
+        self._items = []
+        self._start = 0
@@ -0,0 +1,64 @@
+# Copyright (c) 2017 Christoph Landgraf. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+
+class RowIndex(object):
+    """
+    Fenwick tree over the row counts of a sequence of entries, e.g. the
+    children of a tree node, or the lines of a buffer, which allows to
+    find the entry displayed at a row in O(log n).
+    """
+
+    def __init__(self, counts):
+        self._size = len(counts)
+        self._tree = [0] + counts
+        for i in range(1, self._size + 1):
+            parent = i + (i & -i)
+            if parent <= self._size:
+                self._tree[parent] += self._tree[i]
+        self.total = sum(counts)
+
+    def __len__(self):
+        return self._size
+
+    def prefix(self, index):
+        """
+        Returns the number of rows displayed by the entries before ``index``.
+        """
+        rows = 0
+        while index:
+            rows += self._tree[index]
+            index -= index & -index
+        return rows
+
+    def update(self, index, delta):
+        self.total += delta
+        index += 1
+        while index <= self._size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def append(self, count):
+        """
+        Append an entry displaying ``count`` rows.
+        """
+        index = self._size + 1
+        self._tree.append(count + self.prefix(index - 1) - self.prefix(index - (index & -index)))
+        self._size = index
+        self.total += count
+
+    def find(self, row):
+        """
+        Returns the index of the entry displayed at ``row``, and the
+        offset of ``row`` relative to the first row of that entry.
+        """
+        index = 0
+        step = 1 << self._size.bit_length()
+        while step:
+            next_index = index + step
+            if next_index <= self._size and self._tree[next_index] <= row:
+                index = next_index
+                row -= self._tree[next_index]
+            step >>= 1
+        return index, row
@@ -18,7 +18,9 @@ class WindowBase(object):
     and manages its own dimension.
 
     This class also implements the renderer for cui text in the functions
-    ``_render_line`` and ``_render_lines``.
+    ``_render_line`` and ``_render_lines``. Lines may be rendered starting
+    at a column offset, in which case runs of text before the offset are
+    skipped without being prepared.
 
     Derived classes are ``MiniBufferWindow``, which displays active minibuffers
     and the echo area at the bottom of the screen, as well as ``Window`` which
@@ -27,6 +29,7 @@ class WindowBase(object):
 
     def __init__(self, screen, dimensions):
         self._core = core.Core()
+        self._first_column = 0
         self._init_dimensions(dimensions)
         self._handle = screen.create_window(self._internal_dimensions)
 
@@ -62,19 +65,33 @@ class WindowBase(object):
 
     def _render_line(self, line, soft_tabs, row, col=0,
                      foreground='default', background='default', attributes=[]):
+        # col is the column of the line, not of the window, which
+        # differs if the line is rendered from _first_column.
         _col = col
         if isinstance(line, str):
-            prepared = line.replace('\t', soft_tabs)[:(self.dimensions[1] - _col)]
-            self._add_string(row, _col, prepared, foreground, background, attributes)
-            _col += len(prepared)
+            tabs = line.count('\t')
+            width = len(line) + tabs * (len(soft_tabs) - 1)
+            skip = max(0, self._first_column - _col)
+            screen_col = max(0, _col - self._first_column)
+            if skip < width and screen_col < self.columns:
+                prepared = line.replace('\t', soft_tabs) if tabs else line
+                prepared = prepared[skip:skip + self.columns - screen_col]
+                self._add_string(row, screen_col, prepared, foreground, background, attributes)
+            _col += width
         elif isinstance(line, int):
-            self._add_char(row, _col, line, foreground, background, attributes)
+            if self._is_visible(_col):
+                self._add_char(row, _col - self._first_column, line,
+                               foreground, background, attributes)
             _col += 1
         elif isinstance(line, symbols.Symbol):
-            self._add_symbol(row, _col, line, foreground, background, attributes)
+            if self._is_visible(_col):
+                self._add_symbol(row, _col - self._first_column, line,
+                                 foreground, background, attributes)
             _col += 1
         elif isinstance(line, list):
             for sub_part in line:
+                if _col >= self._first_column + self.columns:
+                    break
                 _col = self._render_line(sub_part, soft_tabs, row, _col,
                                          foreground, background, attributes)
         elif isinstance(line, dict):
@@ -85,12 +102,16 @@ class WindowBase(object):
                                      new_foreground, new_background, new_attributes)
         return _col
 
-    def _render_lines(self, line_iterator):
+    def _is_visible(self, col):
+        return self._first_column <= col < self._first_column + self.columns
+
+    def _render_lines(self, line_iterator, first_column=0):
         soft_tabs = ' ' * self._core.get_variable(['tab-stop'])
+        self._first_column = first_column
         self._handle.move_cursor(0, 0)  # Required for empty buffers
         for idx, row in itertools.islice(enumerate(line_iterator), self.rows):
             self._handle.move_cursor(idx, 0)
-            _col = self._render_line(row, soft_tabs, idx)
+            _col = max(0, self._render_line(row, soft_tabs, idx) - first_column)
             # Clear with background color (e.g. selection)
             if isinstance(row, dict) and 'background' in row:
                 rest = self.columns - _col
@@ -161,7 +182,8 @@ class Window(WindowBase):
             self._buffer.on_pre_render()
             self._buffer.on_pre_render_called = True
         self._buffer.on_pre_render_win(self)
-        self._render_lines(self._buffer.get_lines(self))
+        self._render_lines(self._buffer.get_display_lines(self),
+                           self._state.get('first-column', 0))
 
     def render(self, is_active):
         self._render_buffer()